@@ -0,0 +1,240 @@
+"""
+build_cache.py - Builds ART only when something that goes into the build has changed.
+
+new_run_stampede2.sh and sweep.py use this instead of running make directly. A build
+depends on defs.h, the source code, and the modules that are loaded, so a key is made
+from all of those. Anything in the run directory (config.cfg, submit.sh) is left out,
+so changing only those never rebuilds the code.
+
+Every executable that is built is saved in the cache directory under its key (see
+plan.py for where that is), and the key of the executable in the code directory is
+saved next to it in art.build_key. If the key hasn't changed, there's nothing to do. If
+the same key was built before, here or in any other code directory, the saved
+executable is copied in instead of building it again. Otherwise make is run, and what
+it makes is added to the cache. Only the last max_cached_builds are kept.
+
+Can be run as a script, with the code directory as the first argument. Pass 'rebuild'
+to run make no matter what. The build can also be done in steps, so that make doesn't
+have to run in the same environment as this script: 'restore' brings the executable
+up to date if it can, and otherwise exits with status 3, after which make should be
+run and then this again with 'save'.
+"""
+
+import fnmatch
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+import plan
+
+binary_name = "art"
+key_name = "art.build_key"
+cache_subdir = "art_builds"
+max_cached_builds = 10
+# builds used more recently than this (in seconds) are never removed from the cache
+min_prune_age = 3600
+# the exit status of 'restore' when the code needs to be built
+needs_build_status = 3
+
+# The files that go into the build. Anything else in the code directory, like the run
+# directory or what make produces, doesn't change the executable.
+source_patterns = ["*.c", "*.h", "*.cc", "*.cpp", "*.f", "*.F", "*.f90", "Makefile*"]
+skipped_dirs = ["run"]
+
+# Modules that are only loaded to run these scripts, and so don't change the build
+ignored_modules = ["python", "python3"]
+
+
+def source_files(code_dir):
+    """
+    Find every file that the build depends on, in a consistent order.
+
+    rtype: list of Path
+    """
+    files = []
+    for root, dirs, names in os.walk(code_dir):
+        # don't go into hidden directories (like .git), or the run directory
+        dirs[:] = sorted(
+            d
+            for d in dirs
+            if not d.startswith(".")
+            and not (Path(root) == code_dir and d in skipped_dirs)
+        )
+        for name in sorted(names):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in source_patterns):
+                files.append(Path(root) / name)
+    return files
+
+
+def loaded_modules():
+    """
+    rtype: list of str, the modules that are loaded, like "gsl/2.6"
+    """
+    modules = os.environ.get("LOADEDMODULES", "").split(":")
+    return [
+        m
+        for m in modules
+        if len(m) > 0 and m.split("/")[0].lower() not in ignored_modules
+    ]
+
+
+def build_key(code_dir):
+    """
+    Get the key of what the build in this directory would produce.
+
+    rtype: str
+    """
+    code_dir = Path(code_dir).resolve()
+    digest = hashlib.sha256()
+    for file in source_files(code_dir):
+        digest.update(str(file.relative_to(code_dir)).encode("utf-8") + b"\0")
+        with open(file, "rb") as in_file:
+            digest.update(hashlib.sha256(in_file.read()).digest())
+    for module in loaded_modules():
+        digest.update(module.encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+def _copy_atomic(src, dst):
+    # copy to a temporary file first, so an interruption can't leave a partial
+    # executable behind. Several builds may be saving the same thing at once.
+    temp_path = plan.unique_temp_path(dst)
+    try:
+        shutil.copy2(src, temp_path)
+        os.replace(temp_path, dst)
+    finally:
+        if temp_path.exists():
+            os.remove(temp_path)
+
+
+def _write_key(code_dir, key):
+    with open(code_dir / key_name, "w") as out_file:
+        out_file.write(key + "\n")
+
+
+def _prune(cache, in_use):
+    # Only keep the builds used most recently. The one we just used, and any used in
+    # the last hour, may be in use by another build happening at the same time, so
+    # they're never removed.
+    now = time.time()
+    entries = []
+    for entry in cache.iterdir():
+        try:
+            entries.append((entry.stat().st_mtime, entry))
+        except FileNotFoundError:  # removed by someone else in the meantime
+            pass
+    entries.sort(reverse=True)
+    for mtime, entry in entries[max_cached_builds:]:
+        if entry.name != in_use and now - mtime > min_prune_age:
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def _cache_entry(key):
+    return plan.cache_dir() / cache_subdir / key
+
+
+def restore(code_dir):
+    """
+    Make the executable in code_dir up to date without building it, if we can.
+
+    :returns: how it was done: "unchanged" or "cached", or None if it needs to be built
+    """
+    code_dir = Path(code_dir).resolve()
+    binary = code_dir / binary_name
+    key = build_key(code_dir)
+    cached_binary = _cache_entry(key) / binary_name
+
+    key_path = code_dir / key_name
+    if binary.is_file() and key_path.is_file():
+        with open(key_path, "r") as in_file:
+            if in_file.read().strip() == key:
+                return "unchanged"
+    try:
+        _copy_atomic(cached_binary, binary)
+    except FileNotFoundError:  # never built, or removed from the cache
+        return None
+    _write_key(code_dir, key)
+    # mark it as recently used
+    os.utime(cached_binary.parent)
+    return "cached"
+
+
+def save(code_dir):
+    """
+    Add the executable that was just built in code_dir to the cache.
+    """
+    code_dir = Path(code_dir).resolve()
+    binary = code_dir / binary_name
+    if not binary.is_file():
+        raise RuntimeError(f"make didn't produce {binary}")
+    key = build_key(code_dir)
+    entry = _cache_entry(key)
+    entry.mkdir(parents=True, exist_ok=True)
+    _copy_atomic(binary, entry / binary_name)
+    _write_key(code_dir, key)
+    _prune(entry.parent, key)
+
+
+def build(code_dir, rebuild=False, log_file=None):
+    """
+    Make sure the executable in code_dir is up to date, building it only if needed.
+
+    :param rebuild: whether to run make even if there's a matching build
+    :param log_file: file object to write the output of make to, or None to print it
+    :returns: how it was done: "unchanged", "cached", or "built"
+    """
+    if not rebuild:
+        method = restore(code_dir)
+        if method is not None:
+            return method
+
+    process = subprocess.run(
+        ["make"], cwd=code_dir, stdout=log_file, stderr=subprocess.STDOUT
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"make failed in {code_dir}")
+    save(code_dir)
+    return "built"
+
+
+def main():
+    code_dir = None
+    rebuild = False
+    step = None
+    for arg in sys.argv[1:]:
+        if arg == "rebuild":
+            rebuild = True
+        elif arg in ["restore", "save"]:
+            step = arg
+        elif code_dir is None:
+            code_dir = Path(arg)
+        else:
+            raise ValueError(f"Argument not recognized: {arg}")
+    if code_dir is None:
+        raise ValueError("Need the code directory!")
+
+    if step == "save":
+        save(code_dir)
+        return
+
+    start_time = time.time()
+    if step == "restore":
+        method = None if rebuild else restore(code_dir)
+    else:
+        method = build(code_dir, rebuild)
+    if method == "unchanged":
+        print(f"Nothing that goes into {binary_name} has changed, not building.")
+    elif method == "cached":
+        print(f"Using the {binary_name} built before with these same sources.")
+    elif method is None:
+        print(f"{binary_name} needs to be built.")
+        sys.exit(needs_build_status)
+    else:
+        print(f"Built {binary_name} in {plan.format_time(time.time() - start_time)}")
+
+
+if __name__ == "__main__":
+    main()
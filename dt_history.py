@@ -2,52 +2,186 @@
 dt_history.py
 
 Wrapper function around the snapshot checks dt_history.py script. This also copies the
-plot to my computer for convenience.
+plots to my computer for convenience, all in one Globus transfer once every plot is made.
 
 This does this on all directories in the current working directory that start with
-`runtime`. It does ask the user if they want to do this.
+`runtime`. It does ask the user if they want to do this, for all of them before any are
+run. Then several are run at once, and their output is printed in order as each one
+finishes. The number to run at once can be passed as 'workers=N'. The default is 4.
+
+Once a plot has been copied, a fingerprint of its log directory (the name, size, and
+modification time of every file) is saved next to it. Directories whose logs haven't
+changed since then are skipped entirely, so only runs that have progressed are looked
+at again. Pass 'rerun' to redo every directory anyway.
+
+To run this without being asked, see user_input.py. The key used in the answers file
+is "run_dt_history", which applies to every directory.
 """
+import os
+import sys
+import hashlib
+import shlex
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import user_input
 
-current_dir = Path(".").resolve()
+user_input.parse_batch_args()
 
+n_workers = 4
+rerun = False
+for arg in sys.argv[1:]:
+    if arg.startswith("workers="):
+        n_workers = int(arg.split("=")[-1])
+    elif arg == "rerun":
+        rerun = True
+    else:
+        raise ValueError(f"Argument not recognized: {arg}")
 
-def get_yn_input(prompt):
-    answer = input(prompt + " (y/n) ")
-    while answer.lower() not in ["y", "n"]:
-        answer = input("Enter y or n: ")
+current_dir = Path(".").resolve()
+
+plot_name = "timestep_history.png"
+fingerprint_name = "timestep_history.fingerprint"
 
-    return answer == "y"
+# the plots to copy, with where to put them
+plots = []
 
 
 def run_command(command):
-    subprocess.call(command, shell=True)
+    return subprocess.call(command, shell=True)
+
+
+def fingerprint(log_dir):
+    """
+    Summarize the name, size, and modification time of every file in a log directory,
+    which will change whenever the run writes to its logs.
+
+    rtype: str
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(log_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name in [plot_name, fingerprint_name]:
+                continue
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            relative_path = os.path.relpath(path, log_dir)
+            digest.update(
+                f"{relative_path} {stat.st_size} {stat.st_mtime_ns}\n".encode("utf-8")
+            )
+    return digest.hexdigest()
+
+
+def is_unchanged(log_dir, log_fingerprint):
+    """
+    Whether a log directory is the same as when its plot was last copied.
+    """
+    fingerprint_path = log_dir / fingerprint_name
+    if not (log_dir / plot_name).is_file() or not fingerprint_path.is_file():
+        return False
+    return fingerprint_path.read_text().strip() == log_fingerprint
+
 
+def run_dt_history(log_dir):
+    """
+    Run the dt_history script on one directory.
 
+    rtype: tuple of (int, str), its exit status and everything it printed
+    """
+    # I can't get aliases to work, so we have to use the full name of the
+    # directory here.
+    command = f"python3 $WORK/ART_snapshot_checks/dt_history.py {str(log_dir)}"
+    process = subprocess.run(
+        command,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    return process.returncode, process.stdout
+
+
+# ask the user which directories to do, before starting on any of them
+runtime_dirs = []
 for d in sorted(current_dir.iterdir()):
     if d.name.startswith("runtime"):
         # ask the user if they want to do this
-        if not get_yn_input(f"Run dt_history on this directory: {str(d)}"):
-            continue
-        log_dir = d / "log"
+        if user_input.get_yn_input(
+            f"Run dt_history on this directory: {str(d)}", key="run_dt_history"
+        ):
+            runtime_dirs.append(d)
+
+# then skip the ones that haven't changed. The fingerprints are taken before the
+# analysis, so that anything written while it runs will be picked up next time.
+fingerprints = dict()
+for d in list(runtime_dirs):
+    log_dir = d / "log"
+    fingerprints[log_dir] = fingerprint(log_dir)
+    if not rerun and is_unchanged(log_dir, fingerprints[log_dir]):
+        print(f"Nothing new in {d.name} since its plot was made, skipping it.")
+        runtime_dirs.remove(d)
 
-        # I can't get aliases to work, so we have to use the full name of the
-        # directory here.
-        command = f"python3 $WORK/ART_snapshot_checks/dt_history.py {str(log_dir)}"
-        run_command(command)
+# the directories where something went wrong, which won't be fingerprinted
+failed = []
 
-        # then copy this to my macbook. I need to get a clean name to use as the
-        # filename on the macbook and for the name of the file transfer. Note that if
-        # the folder on the destination doesn't exist (and it won't), it will be
-        # automatically created. I need this because all plots are named
-        # timestep_history.png, and I don't want to overwrite.
+# Each of these is a separate process, so threads are enough to run several at once.
+# Their output is printed in the same order they were asked about.
+with ThreadPoolExecutor(max_workers=n_workers) as executor:
+    futures = [executor.submit(run_dt_history, d / "log") for d in runtime_dirs]
+    for d, future in zip(runtime_dirs, futures):
+        log_dir = d / "log"
+        return_code, output = future.result()
+        print(f"\n{d.name}:", flush=True)
+        print(output, end="")
+        # an old plot may still be there, which shouldn't be sent as if it were new
+        if return_code != 0:
+            print(f"dt_history failed for {d.name}, so its plot won't be copied.")
+            failed.append(d.name)
+            continue
+
+        # then this will be copied to my macbook. I need to get a clean name to use as
+        # the folder on the macbook. Note that if the folder on the destination doesn't
+        # exist (and it won't), it will be automatically created. I need this because
+        # all plots are named timestep_history.png, and I don't want to overwrite.
         run_short_name = d.name.replace("runtime_production_", "")
-        # then make the arguments for the transfer script.
+        plot = log_dir / plot_name
+        # a missing plot would make the whole transfer fail
+        if plot.is_file():
+            plots.append((plot, f"Desktop/{run_short_name}"))
+        else:
+            print(f"No plot was made for {d.name}, so it won't be copied.")
+            failed.append(d.name)
+print()
+
+# Then copy all the plots at once, which is much faster than a transfer for each. The
+# transfer script reads what to copy from a batch file.
+if len(plots) > 0:
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as batch_file:
+        for plot, destination_path in plots:
+            batch_file.write(
+                f"{shlex.quote(str(plot))} {shlex.quote(destination_path)}\n"
+            )
+    try:
         command = f"python3 $HOME/code/new_run/globus_transfer.py "
-        command += f"{str(log_dir)}/timestep_history.png "  # file to transfer
+        command += f"--batchfile={batch_file.name} "  # files to transfer
         command += "macbook "  # destination
-        command += f"Desktop/{run_short_name} "  # location on destination
-        command += f"dt_history_{run_short_name}"  # transfer name.
-        run_command(command)
-        print()
+        command += "dt_history"  # transfer name.
+        return_code = run_command(command)
+    finally:
+        os.remove(batch_file.name)
+
+    # save the fingerprints of everything that was sent, so they can be skipped next
+    # time if nothing changes. If the transfer didn't happen, they'll all be tried again.
+    if return_code == 0:
+        for plot, _ in plots:
+            log_dir = plot.parent
+            (log_dir / fingerprint_name).write_text(fingerprints[log_dir])
+    else:
+        print("The plots were not copied.")
+        failed += [plot.parent.parent.name for plot, _ in plots]
+
+if len(failed) > 0:
+    print(f"Something went wrong for: {', '.join(failed)}")
+    sys.exit(1)
@@ -0,0 +1,265 @@
+"""
+dt_monitor.py
+
+Follows the timestep log of a running job, to watch how the timestep changes while it
+runs without waiting for it to finish and running dt_history.py.
+
+Takes the following optional command line arguments:
+- path to the runtime directory. If not included, the current directory is used.
+- the time to wait between checks of the log, passed as 'interval=N' in seconds. The
+  default is 60.
+- 'once', to check the log once and stop, such as when running this from cron.
+- the name of the log file and its columns, passed as 'log=<name>' and
+  'columns=<step>,<scale factor>,<dt>'. See below for the defaults.
+
+Each time it checks, only what was added to the log since the last check is read. Where
+it left off is saved in dt_monitor.json in the log directory, and the timesteps read so
+far are kept next to it in dt_monitor.series, a flat binary array of (step, scale
+factor, dt) values that can be read with the array module or numpy.fromfile. Only the
+last max_points timesteps are kept. Since both are saved, this can be stopped and
+started again later without reading the log from the beginning.
+
+The layout of the log below is a guess, so a warning is printed if the log is missing,
+or if none of the lines read so far have numbers in the expected columns.
+"""
+
+import array
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+import plan
+
+# The layout of the timestep log written by ART: the name of the file in the log
+# directory, and which whitespace separated column holds each quantity. Lines without
+# numbers in all of these columns, such as headers, are skipped.
+log_name = "timestep.log"
+step_column = 0
+scale_column = 1
+dt_column = 2
+
+state_name = "dt_monitor.json"
+series_name = "dt_monitor.series"
+
+# how many timesteps to keep on disk
+max_points = 100000
+# the timestep is said to have collapsed if it falls below this fraction of the median
+# of the last few timesteps
+collapse_window = 100
+collapse_factor = 0.1
+
+# parse the user options
+runtime_dir = Path(".").resolve()
+interval = 60
+once = False
+for arg in sys.argv[1:]:
+    if arg.startswith("interval="):
+        interval = float(arg.split("=")[-1])
+    elif arg == "once":
+        once = True
+    elif arg.startswith("log="):
+        log_name = arg.split("=")[-1]
+    elif arg.startswith("columns="):
+        columns = [int(c) for c in arg.split("=")[-1].split(",")]
+        if len(columns) != 3:
+            raise ValueError("Need three columns: step, scale factor, and dt")
+        step_column, scale_column, dt_column = columns
+    elif Path(arg).is_dir():
+        runtime_dir = Path(arg).resolve()
+    else:
+        raise ValueError(f"Argument not recognized: {arg}")
+
+log_dir = runtime_dir / "log"
+if not log_dir.is_dir():
+    raise ValueError(f"No log directory in {runtime_dir}")
+
+
+# ======================================================================================
+#
+# Reading only what's new
+#
+# ======================================================================================
+class LogFollower(object):
+    """
+    Reads the lines added to a log file since the last time it was read.
+
+    Only complete lines are read, so that a line that is still being written is picked
+    up the next time. If the file is replaced or gets shorter, it's read again from the
+    start.
+    """
+
+    def __init__(self, log_path, state_path):
+        self.log_path = log_path
+        self.state_path = state_path
+        if state_path.is_file():
+            with open(state_path, "r") as in_file:
+                state = json.load(in_file)
+        else:
+            state = {"offset": 0, "inode": None}
+        self.offset = state["offset"]
+        self.inode = state["inode"]
+
+    def read_new_lines(self):
+        """
+        rtype: list of str
+        """
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return []
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.inode = stat.st_ino
+            self.offset = 0
+        if stat.st_size == self.offset:
+            return []
+
+        with open(self.log_path, "rb") as in_file:
+            in_file.seek(self.offset)
+            data = in_file.read(stat.st_size - self.offset)
+        # leave anything after the last newline for next time
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        return data[:end].decode("utf-8", errors="replace").splitlines()
+
+    def save(self):
+        plan.atomic_write_json(
+            self.state_path, {"offset": self.offset, "inode": self.inode}
+        )
+
+
+def parse_line(line):
+    """
+    Get the step, scale factor, and timestep from one line of the log.
+
+    rtype: tuple of 3 floats, or None if this line isn't a timestep
+    """
+    items = line.split()
+    try:
+        return tuple(float(items[c]) for c in [step_column, scale_column, dt_column])
+    except (IndexError, ValueError):
+        return None
+
+
+# ======================================================================================
+#
+# Keeping the timesteps on disk
+#
+# ======================================================================================
+class TimestepSeries(object):
+    """
+    The timesteps read so far, stored as a flat array of (step, scale factor, dt).
+
+    New timesteps are appended to the end of the file. Once there are more than
+    max_points, the oldest are dropped and the file is written again from scratch.
+    """
+
+    def __init__(self, path, max_points):
+        self.path = path
+        self.max_points = max_points
+        self.values = array.array("d")
+        if path.is_file():
+            with open(path, "rb") as in_file:
+                self.values.frombytes(in_file.read())
+        self.n_saved = len(self.values)
+
+    def __len__(self):
+        return len(self.values) // 3
+
+    def append(self, step, scale, dt):
+        self.values.extend([step, scale, dt])
+
+    def dts(self, n):
+        """
+        Get the last n timesteps.
+
+        rtype: list of float
+        """
+        start = max(len(self.values) - 3 * n, 0)
+        return list(self.values[start + 2 :: 3])
+
+    def latest(self):
+        return tuple(self.values[-3:])
+
+    def save(self):
+        if len(self) > self.max_points:
+            del self.values[: 3 * (len(self) - self.max_points)]
+            temp_path = plan.unique_temp_path(self.path)
+            with open(temp_path, "wb") as out_file:
+                self.values.tofile(out_file)
+            os.replace(temp_path, self.path)
+        else:
+            with open(self.path, "ab") as out_file:
+                self.values[self.n_saved :].tofile(out_file)
+        self.n_saved = len(self.values)
+
+
+# ======================================================================================
+#
+# Then watch the log
+#
+# ======================================================================================
+follower = LogFollower(log_dir / log_name, log_dir / state_name)
+series = TimestepSeries(log_dir / series_name, max_points)
+# whether we've already said the log is missing, so it isn't repeated every check
+warned_missing = False
+
+
+def check():
+    """
+    Read any new timesteps and report on the latest one.
+    """
+    global warned_missing
+    if not follower.log_path.is_file():
+        if not warned_missing:
+            print(f"WARNING: {follower.log_path} doesn't exist (yet)", flush=True)
+            warned_missing = True
+        return
+    warned_missing = False
+
+    lines = follower.read_new_lines()
+    n_new = 0
+    for line in lines:
+        timestep = parse_line(line)
+        if timestep is not None:
+            series.append(*timestep)
+            n_new += 1
+    # The layout of the log is assumed above, so if nothing in it has ever matched
+    # that, it's more likely that the layout is wrong than that there are no steps
+    if len(lines) > 0 and len(series) == 0:
+        print(
+            f"WARNING: none of the {len(lines)} lines read from {follower.log_path} "
+            f"have numbers in columns {step_column}, {scale_column}, {dt_column}. "
+            f"Check 'log=' and 'columns='. The last line was:\n    {lines[-1]}",
+            flush=True,
+        )
+    # Only write anything if the log changed, so that the log directory isn't touched
+    # otherwise (dt_history.py uses that to know whether there's anything new). The
+    # timesteps are saved before where we are in the log, so that an interruption can
+    # only make us read something twice, never skip it.
+    if len(lines) > 0:
+        series.save()
+        follower.save()
+
+    if n_new == 0:
+        if once:
+            print(f"No new timesteps in {log_dir / log_name}")
+        return
+
+    step, scale, dt = series.latest()
+    median_dt = statistics.median(series.dts(collapse_window))
+    line = (
+        f"{time.strftime('%H:%M:%S')}  {n_new} new timesteps, now at step {step:.0f}  "
+        f"a = {scale:.4f}  dt = {dt:.3g}  (median of last {collapse_window}: "
+        f"{median_dt:.3g})"
+    )
+    if dt < collapse_factor * median_dt:
+        line += "  <-- the timestep has collapsed!"
+    print(line, flush=True)
+
+
+check()
+while not once:
+    time.sleep(interval)
+    check()
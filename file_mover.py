@@ -0,0 +1,252 @@
+"""
+file_mover.py - Moves and copies files for handle_out_files.py, handle_halo_files.py,
+and handle_runtime.py, with several going at once.
+
+Moves are a rename whenever the two places are on the same filesystem, so they are
+nearly instant. Copies use os.copy_file_range, which lets the filesystem copy the data
+without it passing through this script, falling back to sendfile and then to a regular
+copy if that isn't supported. Since a copy of a large output can take a while, several
+copies run at once in a pool of threads.
+
+When we just need a file in two places, such as the last output that is kept for
+restarting the next run, it can be linked instead. This tries a hard link first, then
+a reflink (a copy that shares the data until one of them is changed), and only makes a
+real copy if neither works. A hard link means the two names are the same file, which
+is fine for outputs since they are never changed after they are written.
+"""
+
+import collections
+import errno
+import fcntl
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import plan
+
+# errors that mean a faster copy method isn't available here, so that we should try
+# the next one
+_unsupported_errors = [errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP]
+
+# how much to copy at a time with copy_file_range and sendfile
+_copy_block = 1024**3
+
+# the ioctl request that asks the filesystem for a reflink, from linux/fs.h
+_FICLONE = 0x40049409
+
+
+# ======================================================================================
+#
+# Single file operations
+#
+# ======================================================================================
+def _copy_with(copy_func, in_fd, out_fd, size):
+    copied = 0
+    while copied < size:
+        n_copied = copy_func(in_fd, out_fd, copied, min(_copy_block, size - copied))
+        if n_copied == 0:
+            break
+        copied += n_copied
+    return copied
+
+
+def _copy_file_range(in_fd, out_fd, offset, count):
+    return os.copy_file_range(in_fd, out_fd, count, offset, offset)
+
+
+def _sendfile(in_fd, out_fd, offset, count):
+    return os.sendfile(out_fd, in_fd, offset, count)
+
+
+def copy(src, dst):
+    """
+    Copy a file, including its metadata, like shutil.copy2.
+    """
+    with open(src, "rb") as in_file, open(dst, "wb") as out_file:
+        in_fd = in_file.fileno()
+        out_fd = out_file.fileno()
+        size = os.fstat(in_fd).st_size
+        for copy_func in [_copy_file_range, _sendfile]:
+            try:
+                _copy_with(copy_func, in_fd, out_fd, size)
+                break
+            except (OSError, AttributeError) as e:
+                # AttributeError is for systems without these functions. Anything
+                # other than the method not being supported is a real error.
+                if isinstance(e, OSError) and e.errno not in _unsupported_errors:
+                    raise
+                # start over with the next method
+                os.ftruncate(out_fd, 0)
+        else:
+            in_file.seek(0)
+            out_file.seek(0)
+            shutil.copyfileobj(in_file, out_file, 16 * 1024**2)
+    shutil.copystat(src, dst)
+
+
+def link(src, dst):
+    """
+    Put a file in a second place without copying its data if we can.
+
+    rtype: str, the method used: "hard link", "reflink", or "copy"
+    """
+    # This may have already been linked the last time the scripts were run. Opening
+    # the destination to reflink or copy would then empty the original too.
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return "hard link"
+    try:
+        os.link(src, dst)
+        return "hard link"
+    except OSError:
+        pass
+
+    try:
+        with open(src, "rb") as in_file, open(dst, "wb") as out_file:
+            fcntl.ioctl(out_file.fileno(), _FICLONE, in_file.fileno())
+        shutil.copystat(src, dst)
+        return "reflink"
+    except OSError:
+        pass
+
+    copy(src, dst)
+    return "copy"
+
+
+def move(src, dst):
+    """
+    Move a file. This is a rename, unless the destination is on another filesystem.
+    """
+    # If the destination is a hard link to this file, which happens when the last
+    # output was linked in a previous run, a rename silently does nothing. So we just
+    # remove this name instead.
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        os.unlink(src)
+        return
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        copy(src, dst)
+        os.unlink(src)
+
+
+# ======================================================================================
+#
+# Doing many at once
+#
+# ======================================================================================
+class FileMover(object):
+    """
+    Runs moves and copies in a pool of threads.
+
+    Everything is first queued up with move(), copy(), and link(), and nothing happens
+    until run() is called, which does it all and waits for it to finish. This lets the
+    scripts check everything, and print what will happen with print_plan(), before
+    changing anything.
+    """
+
+    def __init__(self, n_workers):
+        self.n_workers = n_workers
+        self.throughput = plan.Throughput()
+        # each of these is a list of (source, destination, size in bytes)
+        self.copies = []
+        self.links = []
+        self.moves = []
+
+    @staticmethod
+    def _size(src, size):
+        if size is None:
+            size = os.stat(src).st_size
+        return size
+
+    def move(self, src, dst, size=None):
+        self.moves.append((src, dst, self._size(src, size)))
+
+    def copy(self, src, dst, size=None):
+        self.copies.append((src, dst, self._size(src, size)))
+
+    def link(self, src, dst, size=None):
+        self.links.append((src, dst, self._size(src, size)))
+
+    def _actions(self):
+        # the copies go first, since they take the longest
+        return [
+            ("copy", "copying", copy, self.copies),
+            ("link", "linking", link, self.links),
+            ("move", "moving", move, self.moves),
+        ]
+
+    def print_plan(self, list_all=False):
+        """
+        Print how much will be done and how long it should take.
+
+        :param list_all: whether to also print every single action
+        """
+        if list_all:
+            print("Everything that will be done:")
+        work = dict()
+        for kind, _, _, actions in self._actions():
+            work[kind] = (len(actions), sum(size for _, _, size in actions))
+            if list_all:
+                for src, dst, size in actions:
+                    print(f"    {kind} {src} -> {dst} ({plan.format_bytes(size)})")
+        print("Altogether, this will do:")
+        plan.print_estimate(work, self.throughput)
+
+    def run(self):
+        """
+        Do everything that was queued up. If anything failed, all the failures are
+        reported together once everything else is done.
+
+        Everything goes into the same pool, so that moves don't have to wait for every
+        copy to finish. Each kind of action is timed from when the first one starts
+        to when the last one ends, for later estimates.
+        """
+        errors = []
+        link_methods = collections.Counter()
+        # the first start and last end of each kind of action
+        times = collections.defaultdict(list)
+        times_lock = threading.Lock()
+
+        def timed(kind, func, src, dst):
+            start_time = time.time()
+            try:
+                return func(src, dst)
+            finally:
+                with times_lock:
+                    times[kind] += [start_time, time.time()]
+
+        futures = dict()
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            for kind, verb, func, actions in self._actions():
+                for src, dst, _ in actions:
+                    future = executor.submit(timed, kind, func, src, dst)
+                    futures[future] = (kind, f"{verb} {src}")
+
+        failed_kinds = set()
+        for future, (kind, description) in futures.items():
+            if future.exception() is not None:
+                errors.append(f"Error {description}: {future.exception()}")
+                failed_kinds.add(kind)
+            elif kind == "link":
+                link_methods[future.result()] += 1
+        # only time the kinds where everything went right, so that failures that happen
+        # immediately don't make things look faster than they are
+        for kind, _, _, actions in self._actions():
+            if len(actions) == 0 or kind in failed_kinds:
+                continue
+            elapsed = max(times[kind]) - min(times[kind])
+            n_bytes = sum(size for _, _, size in actions)
+            self.throughput.record(kind, len(actions), n_bytes, elapsed)
+
+        print(f"Copied {len(self.copies)} files and moved {len(self.moves)} files.")
+        if len(self.links) > 0:
+            methods = ", ".join(f"{n} by {m}" for m, n in sorted(link_methods.items()))
+            print(f"Kept {len(self.links)} files in both places: {methods}.")
+        self.copies = []
+        self.links = []
+        self.moves = []
+        if len(errors) > 0:
+            raise RuntimeError("\n".join(errors))
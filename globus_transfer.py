@@ -6,24 +6,73 @@ Copies one file using Globus. Takes the following command line arguments:
 - name of the destination endpoint. Must match one of my bookmarks!
 - path to copy the item to. This is relative to the path defined in the bookmark.
 - (optional) label for the transfer
+
+Many files can also be copied to the same endpoint as a single Globus task, which is
+much faster than one task for each. Their paths are given in a file passed as
+'--batchfile=<file>', where each line is the path to a source and the path to copy it
+to, separated by a space (use quotes if a path has spaces). Lines starting with # are
+skipped. Then the only other arguments are the name of the destination endpoint and,
+optionally, the label for the transfer.
+
+To run this without being asked, see user_input.py. The key used in the answers file
+is "execute".
+
+The bookmarks are saved in globus_bookmarks.json in the cache directory (see plan.py),
+and only fetched from Globus again once they are a day old, or if one that's needed
+isn't there. Pass '--refresh-bookmarks' to fetch them again anyway.
 """
 import sys
+import json
+import shlex
+import time
 from pathlib import Path
 import subprocess
-
-# validate user options
-if len(sys.argv) < 4:
-    raise ValueError("Need 3 command line options!")
-if len(sys.argv) > 5:
-    raise ValueError("Too many command line options!")
-# get user options
-source_end_path = sys.argv[1]
-destination_name = sys.argv[2]
-destination_end_path = sys.argv[3]
-if len(sys.argv) == 5:
-    label = sys.argv[4]
+import plan
+import user_input
+
+user_input.parse_batch_args()
+
+bookmark_cache_name = "globus_bookmarks.json"
+bookmark_cache_ttl = 24 * 3600  # in seconds
+
+refresh_bookmarks = "--refresh-bookmarks" in sys.argv
+if refresh_bookmarks:
+    sys.argv.remove("--refresh-bookmarks")
+
+batch_file = None
+for arg in sys.argv[1:]:
+    if arg.startswith("--batchfile="):
+        batch_file = arg.split("=", 1)[-1]
+        sys.argv.remove(arg)
+
+# validate user options, and get the pairs of (source path, destination path)
+if batch_file is None:
+    if len(sys.argv) < 4:
+        raise ValueError("Need 3 command line options!")
+    if len(sys.argv) > 5:
+        raise ValueError("Too many command line options!")
+    # get user options
+    end_paths = [(sys.argv[1], sys.argv[3])]
+    destination_name = sys.argv[2]
+    label = sys.argv[4] if len(sys.argv) == 5 else None
 else:
-    label = None
+    if len(sys.argv) < 2:
+        raise ValueError("Need the destination with a batch file!")
+    if len(sys.argv) > 3:
+        raise ValueError("Too many command line options!")
+    end_paths = []
+    with open(batch_file, "r") as in_file:
+        for line in in_file:
+            if len(line.strip()) == 0 or line.strip().startswith("#"):
+                continue
+            items = shlex.split(line)
+            if len(items) != 2:
+                raise ValueError(f"Need a source and destination on each line: {line}")
+            end_paths.append((items[0], items[1]))
+    if len(end_paths) == 0:
+        raise ValueError(f"Nothing to transfer in {batch_file}")
+    destination_name = sys.argv[1]
+    label = sys.argv[2] if len(sys.argv) == 3 else None
 
 # ======================================================================================
 #
@@ -42,16 +91,13 @@ elif str(working_dir).startswith("/home1/06912/tg862118"):
 else:
     raise ValueError("I don't know how to transfer from here!")
 
+
 # ======================================================================================
 #
 # Parse the Globus bookmarks to know where to transfer an item
 #
 # ======================================================================================
-# run the bookmark command to see where I know how to transfer things
-process = subprocess.run(["globus", "bookmark", "list"], stdout=subprocess.PIPE)
-bookmarks_text = process.stdout.decode("utf-8")
-
-# then parse the bookmark output. Use a class for this, for simplicity
+# Use a class for this, for simplicity
 class Bookmark(object):
     def __init__(self, bookmark_name, endpoint_id, path):
         self.name = bookmark_name
@@ -59,33 +105,77 @@ class Bookmark(object):
         self.path = path
 
 
-bookmarks = []
-for line in bookmarks_text.split("\n"):
-    # skip header, divider, and empty rows:
-    if ("Bookmark ID" in line) or ("-------" in line) or (len(line.strip()) == 0):
-        continue
-
-    # get the entries, and clean them up. Vertical bars used to separate columns
-    items = [l.strip() for l in line.split("|")]
-    bookmarks.append(Bookmark(items[0], items[2], items[4]))
+def fetch_bookmarks():
+    """
+    Ask Globus for all my bookmarks.
+
+    rtype: list of Bookmark
+    """
+    # run the bookmark command to see where I know how to transfer things
+    process = subprocess.run(["globus", "bookmark", "list"], stdout=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError("Could not get the Globus bookmarks.")
+    bookmarks_text = process.stdout.decode("utf-8")
+
+    bookmarks = []
+    for line in bookmarks_text.split("\n"):
+        # skip header, divider, and empty rows:
+        if ("Bookmark ID" in line) or ("-------" in line) or (len(line.strip()) == 0):
+            continue
+
+        # get the entries, and clean them up. Vertical bars used to separate columns
+        items = [l.strip() for l in line.split("|")]
+        bookmarks.append(Bookmark(items[0], items[2], items[4]))
+    return bookmarks
+
+
+def load_bookmarks(refresh):
+    """
+    Get my bookmarks from the cache, or from Globus if the cache is too old.
+
+    :param refresh: whether to ignore the cache and get them from Globus
+    rtype: dict of {bookmark name: Bookmark}
+    """
+    cache_path = plan.cache_dir() / bookmark_cache_name
+    if not refresh and cache_path.is_file():
+        with open(cache_path, "r") as in_file:
+            cache = json.load(in_file)
+        if time.time() - cache["fetched"] < bookmark_cache_ttl:
+            return {
+                b["name"]: Bookmark(b["name"], b["endpoint_id"], b["path"])
+                for b in cache["bookmarks"]
+            }
+
+    bookmarks = fetch_bookmarks()
+    cache = {
+        "fetched": time.time(),
+        "bookmarks": [
+            {"name": b.name, "endpoint_id": b.endpoint_id, "path": b.path}
+            for b in bookmarks
+        ],
+    }
+    plan.atomic_write_json(cache_path, cache)
+    return {b.name: b for b in bookmarks}
+
+
+bookmarks = load_bookmarks(refresh_bookmarks)
+# If one we need isn't there, it may have been added since the cache was made
+if not refresh_bookmarks and (
+    source_name not in bookmarks or destination_name not in bookmarks
+):
+    bookmarks = load_bookmarks(refresh=True)
 
 # ======================================================================================
 #
 # match the user's commands to a bookmark
 #
 # ======================================================================================
-# set up dummy variables to check that the paths were found
-source, destination = None, None
-for b in bookmarks:
-    if b.name == source_name:
-        source = b
-    if b.name == destination_name:
-        destination = b
-
-if source is None:
+if source_name not in bookmarks:
     raise ValueError(f"Source bookmark {source_name} not found!")
-if destination is None:
+if destination_name not in bookmarks:
     raise ValueError(f"Destination bookmark {destination_name} not found!")
+source = bookmarks[source_name]
+destination = bookmarks[destination_name]
 
 # ======================================================================================
 #
@@ -94,41 +184,50 @@ if destination is None:
 # ======================================================================================
 # Now we can extend the paths. The source dir will be the working directory plus the
 # path the user said
-source_file_path = working_dir / source_end_path
-# the destination is simply the bookmark path plus the user path
-destination_file_path = (
-    Path(destination.path) / destination_end_path / source_file_path.name
-)
+file_paths = []
+for source_end_path, destination_end_path in end_paths:
+    source_file_path = working_dir / source_end_path
+    # the destination is simply the bookmark path plus the user path
+    destination_file_path = (
+        Path(destination.path) / destination_end_path / source_file_path.name
+    )
+    file_paths.append((source_file_path, destination_file_path))
 
 # ======================================================================================
 #
 # Then do the transfer
 #
 # ======================================================================================
-def get_yn_input(prompt):
-    answer = input(prompt + " (y/n) ")
-    while answer.lower() not in ["y", "n"]:
-        answer = input("Enter y or n: ")
-
-    return answer == "y"
-
-
-print(f"\n{source.name}:{str(source_file_path)}")
-print("Will be transferred to")
-print(f"{destination.name}:{str(destination_file_path)}")
-if not get_yn_input("\nDo you want to execute this?"):
+for source_file_path, destination_file_path in file_paths:
+    print(f"\n{source.name}:{str(source_file_path)}")
+    print("Will be transferred to")
+    print(f"{destination.name}:{str(destination_file_path)}")
+# Anything calling this checks the exit status to know whether the files were sent, so
+# not doing it counts as a failure
+if not user_input.get_yn_input("\nDo you want to execute this?", key="execute"):
     print("exiting...")
-    exit()
+    sys.exit(1)
 
 # piece together all the options
 command = ["globus", "transfer"]
 if label is not None:
     command += ["--label", label]
-command += [
-    f"{source.endpoint_id}:{source_file_path}",
-    f"{destination.endpoint_id}:{destination_file_path}",
-]
+if len(file_paths) == 1:
+    source_file_path, destination_file_path = file_paths[0]
+    command += [
+        f"{source.endpoint_id}:{source_file_path}",
+        f"{destination.endpoint_id}:{destination_file_path}",
+    ]
+    batch_text = None
+else:
+    # Globus reads the pairs of paths from stdin when the batch is "-"
+    command += ["--batch", "-", source.endpoint_id, destination.endpoint_id]
+    batch_text = "".join(
+        f"{shlex.quote(str(source_path))} {shlex.quote(str(destination_path))}\n"
+        for source_path, destination_path in file_paths
+    )
 
 # then do it!
-subprocess.run(command)
+process = subprocess.run(command, input=batch_text, text=True)
 # Do not delete the file afterwards, since the transfer will be put in the background
+sys.exit(process.returncode)
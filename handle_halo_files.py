@@ -7,11 +7,35 @@ run of halo finding to work properly.
 
 Must be run from the folder containing all the runs, and only works for the
 production runs.
+
+The files of all runs are moved at the same time. This takes one optional argument: the
+number of files to move or copy at once, passed as 'workers=N'. The default is 8.
+
+Runs whose halos directory hasn't changed since the last time this was run are skipped
+without listing it (see sync_state.py). Pass 'rescan' to look at every run anyway.
+
+Before anything is moved, this prints how much will be done and how long it should
+take (see plan.py). Pass 'dry_run' to list every move and stop there.
 """
 
+import sys
 from pathlib import Path
-import shutil
-from collections import defaultdict
+import file_mover
+import snapshot_catalog
+import sync_state
+
+n_workers = 8
+rescan = False
+dry_run = False
+for arg in sys.argv[1:]:
+    if arg.startswith("workers="):
+        n_workers = int(arg.split("=")[-1])
+    elif arg == "rescan":
+        rescan = True
+    elif arg == "dry_run":
+        dry_run = True
+    else:
+        raise ValueError(f"Argument not recognized: {arg}")
 
 current_dir = Path(".").resolve()
 
@@ -22,52 +46,56 @@ if current_dir.parts[1] != "scratch":
 scratch = current_dir.parents[2]
 analysis_dir = scratch / "art_runs" / "analysis" / "production"
 
-# ======================================================================================
-#
-# convenience functions
-#
-# ======================================================================================
-def get_scale_factor(filename):
-    """
-    rtype: str
-    """
-    if filename.startswith("halos_"):
-        return filename[7:13]
-    elif filename.startswith("out_"):
-        return filename[5:11]
-    else:
-        return None
-
-
 # ======================================================================================
 #
 # Then actually do this
 #
 # ======================================================================================
+# We first go through all the runs to find what needs to be done, then it all gets done
+# at once.
+mover = file_mover.FileMover(n_workers)
+# the state of each run to update once everything is moved, with the last halos
+handled = []
 for run_dir in current_dir.iterdir():
     run_name = run_dir.name
     halos_dir = run_dir / "run" / "halos"
     analysis_halos_dir = analysis_dir / run_name / "run" / "halos"
 
+    # skip runs where nothing has happened since last time
+    state = sync_state.SyncState(run_dir)
+    if not rescan and state.is_unchanged(halos_dir):
+        continue
+
     # Find all files
-    groups = defaultdict(list)
-    last_scale = 0
-    for file in halos_dir.iterdir():
-        scale = get_scale_factor(file.name)
-        if scale is not None:
-            groups[scale].append(file)
-            # Also keep track of the last output, which will be treated specially
-            if float(scale) > float(last_scale):
-                last_scale = scale
+    catalog = snapshot_catalog.SnapshotCatalog(halos_dir, snapshot_catalog.halo_kinds)
+    if len(catalog) == 0:
+        continue
+    last_label = catalog.labels[catalog.last]
+    handled.append((state, halos_dir, last_label))
+
+    # If the last halos are the ones we already linked, there's nothing new here
+    if len(catalog) == 1 and last_label == state.last_scale(halos_dir):
+        continue
 
     # Move files to the analysis directory
-    for scale, files in groups.items():
-        for f in files:
+    for scale in catalog.scales:
+        for f in catalog.files[scale]:
             new_file_loc = analysis_halos_dir / f.name
-            # If it's the last scale factor, just copy it so that we keep the original
-            # intact here
-            if scale == last_scale:
-                shutil.copy2(f, new_file_loc)
+            # If it's the last scale factor, link it (or copy it if we can't) so that
+            # we keep the original intact here
+            if scale == catalog.last:
+                mover.link(f.path, new_file_loc, f.size)
             # otherwise, move the files
             else:
-                f.rename(new_file_loc)
+                mover.move(f.path, new_file_loc, f.size)
+
+# Say what will happen, and stop there if this is just a dry run
+mover.print_plan(list_all=dry_run)
+if dry_run:
+    exit()
+mover.run()
+
+# only now that everything is in place do we record it, so that anything that failed
+# will be looked at again next time
+for state, directory, last_label in handled:
+    state.update(directory, last_label)
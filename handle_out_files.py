@@ -6,11 +6,36 @@ last output in working_out
 
 Must be run from the folder containing all the runs, and only works for the
 production runs.
+
+The files of all runs are moved at the same time. This takes one optional argument: the
+number of files to move or copy at once, passed as 'workers=N'. The default is 8.
+
+Runs whose working_out directory hasn't changed since the last time this was run are
+skipped without listing it (see sync_state.py). Pass 'rescan' to look at every run
+anyway.
+
+Before anything is moved, this prints how much will be done and how long it should
+take (see plan.py). Pass 'dry_run' to list every move and stop there.
 """
 
+import sys
 from pathlib import Path
-import shutil
-from collections import defaultdict
+import file_mover
+import snapshot_catalog
+import sync_state
+
+n_workers = 8
+rescan = False
+dry_run = False
+for arg in sys.argv[1:]:
+    if arg.startswith("workers="):
+        n_workers = int(arg.split("=")[-1])
+    elif arg == "rescan":
+        rescan = True
+    elif arg == "dry_run":
+        dry_run = True
+    else:
+        raise ValueError(f"Argument not recognized: {arg}")
 
 current_dir = Path(".").resolve()
 
@@ -20,58 +45,65 @@ if current_dir.parts[1] != "scratch":
     raise RuntimeError("Not on scratch")
 
 
-# ======================================================================================
-#
-# convenience functions
-#
-# ======================================================================================
-def get_scale_factor(filename):
-    """
-    rtype: str
-    """
-    if filename.startswith("continuous_a"):
-        return filename[12:18]
-    else:
-        return None
-
-
 # ======================================================================================
 #
 # Then actually do this
 #
 # ======================================================================================
+# We first go through all the runs to find what needs to be done, so that we can check
+# that everything looks right before moving anything. Then it all gets done at once.
+mover = file_mover.FileMover(n_workers)
+# the state of each run to update once everything is moved, with the last output
+handled = []
 for run_dir in sorted(current_dir.iterdir()):
     out_dir = run_dir / "run" / "out"
     working_out_dir = run_dir / "run" / "working_out"
 
+    # skip runs where nothing has happened since last time
+    state = sync_state.SyncState(run_dir)
+    if not rescan and state.is_unchanged(working_out_dir):
+        last_label = state.last_scale(working_out_dir)
+        print(f"Nothing new for {run_dir.name}, last output at a = {last_label}")
+        continue
+
     # check that the out directory is empty
     if len([f for f in out_dir.iterdir()]) > 0:
         raise RuntimeError(f"Out directory for {run_dir.name} is not empty")
 
     # Find all output files
-    groups = defaultdict(list)
-    last_scale = 0
-    for file in working_out_dir.iterdir():
-        scale = get_scale_factor(file.name)
-        if scale is not None:
-            groups[scale].append(file)
-            # Also keep track of the last output, which will be treated specially
-            if float(scale) > float(last_scale):
-                last_scale = scale
-
-    print(f"Last output for {run_dir.name} at a = {last_scale}")
+    catalog = snapshot_catalog.SnapshotCatalog(
+        working_out_dir, snapshot_catalog.output_kinds
+    )
+    if len(catalog) == 0:
+        print(f"No outputs for {run_dir.name}")
+        continue
+
+    last_label = catalog.labels[catalog.last]
+    print(f"Last output for {run_dir.name} at a = {last_label}")
+    handled.append((state, working_out_dir, last_label))
 
     # Move files to the analysis directory. But if there's only one, that means that
     # the simulation didn't progress at all. So we don't need to move anything.
-    if len(groups) == 1:
+    if len(catalog) == 1:
         continue
-    for scale, files in groups.items():
-        for f in files:
+    for scale in catalog.scales:
+        for f in catalog.files[scale]:
             new_file_loc = out_dir / f.name
-            # If it's the last scale factor, just copy it so that we keep the original
-            # intact here
-            if scale == last_scale:
-                shutil.copy2(f, new_file_loc)
+            # If it's the last scale factor, link it (or copy it if we can't) so that
+            # we keep the original intact here
+            if scale == catalog.last:
+                mover.link(f.path, new_file_loc, f.size)
             # otherwise, move the files
             else:
-                f.rename(new_file_loc)
+                mover.move(f.path, new_file_loc, f.size)
+
+# Say what will happen, and stop there if this is just a dry run
+mover.print_plan(list_all=dry_run)
+if dry_run:
+    exit()
+mover.run()
+
+# only now that everything is in place do we record it, so that anything that failed
+# will be looked at again next time
+for state, directory, last_label in handled:
+    state.update(directory, last_label)
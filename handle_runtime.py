@@ -4,14 +4,38 @@ handle_runtime.py
 Moves the stdout and log files into their proper runtime directory.
 
 Must be run from the directory where the files are.
+
+To run this without being asked, see user_input.py. The key used in the answers file
+is "handle_runtime", which applies to every directory.
+
+Everything to move is found before anything is moved. Pass 'dry_run' to print the
+moves and stop there.
 """
 
+import sys
 from pathlib import Path
+import file_mover
+import user_input
+
+user_input.parse_batch_args()
+
+dry_run = False
+for arg in sys.argv[1:]:
+    if arg == "dry_run":
+        dry_run = True
+    else:
+        raise ValueError(f"Argument not recognized: {arg}")
 
 current_dir = Path(".").resolve()
 
-# find all the runtime directories
-runtime_dirs = [d for d in current_dir.iterdir() if d.name.startswith("runtime")]
+# find all the runtime directories and submit files, in one pass over this directory
+runtime_dirs = []
+submit_files = []
+for f in current_dir.iterdir():
+    if f.name.startswith("runtime"):
+        runtime_dirs.append(f)
+    elif f.name.startswith("submit_") and f.name.endswith(".sh"):
+        submit_files.append(f)
 
 # ==============================================================================
 #
@@ -23,8 +47,13 @@ def get_job_name_from_submit_file(submit_file):
         for line in submit:
             if line.startswith("#SBATCH --job-name"):
                 return line.strip().split("=")[-1]
+            # The #SBATCH lines all come before the first command, so we can stop
+            # there instead of reading the whole script. The shebang and any other
+            # comments or blank lines can come before them.
+            if len(line.strip()) > 0 and not line.startswith("#"):
+                break
     # if we got here we didn't find the name, so this isn't a submit script
-    raise ValueError("This doesn't look like a submission script.")
+    raise ValueError(f"{submit_file.name} doesn't look like a submission script.")
 
 
 def get_job_name_from_runtime_dir(runtime_dir):
@@ -33,38 +62,38 @@ def get_job_name_from_runtime_dir(runtime_dir):
     return "_".join(base.split("_")[:-1])
 
 
-def get_yn_input(prompt):
-    answer = input(prompt + " (y/n) ")
-    while answer.lower() not in ["y", "n"]:
-        answer = input("Enter y or n: ")
-
-    return answer == "y"
-
-
 # ==============================================================================
 #
 # Go through and do the work
 #
 # ==============================================================================
+# We first find everything that needs to be moved, so that any problems show up before
+# anything is changed. Then it all gets done at once.
+mover = file_mover.FileMover(8)
+# read the job name of every submit file once, to look them up for each directory
+submit_files_by_job = dict()
+for f in submit_files:
+    submit_files_by_job.setdefault(get_job_name_from_submit_file(f), []).append(f)
+
 for r_d in sorted(runtime_dirs):
-    if not get_yn_input(f"Handle {r_d.name}?"):
+    if not user_input.get_yn_input(f"Handle {r_d.name}?", key="handle_runtime"):
         continue
 
     # get the name of the stdout file
     stdout_old_loc = current_dir / r_d.name.replace("runtime_", "stdout_")
     stdout_new_loc = r_d / "log" / "stdout.full.log"
-    stdout_old_loc.rename(stdout_new_loc)
-
-    # then find the correct submit file. Double check that there's only one
-    n_moves = 0
-    job_name = get_job_name_from_runtime_dir(r_d)
-    for f in current_dir.iterdir():
-        if f.name.startswith("submit_") and f.name.endswith(".sh"):
-            this_name = get_job_name_from_submit_file(f)
-            if this_name == job_name:
-                f.rename(r_d / f.name)
-                n_moves += 1
-    if n_moves == 0:
+    mover.move(stdout_old_loc, stdout_new_loc)
+
+    # then find the correct submit file. Double check that there's only one. It's
+    # removed from the index, since it can't be moved into two directories.
+    job_submit_files = submit_files_by_job.pop(get_job_name_from_runtime_dir(r_d), [])
+    if len(job_submit_files) == 0:
         raise ValueError(f"No submit files found for directory: {r_d.name}")
-    if n_moves > 1:
+    if len(job_submit_files) > 1:
         raise ValueError(f"Too many submit files found for directory: {r_d.name}")
+    mover.move(job_submit_files[0], r_d / job_submit_files[0].name)
+
+mover.print_plan(list_all=dry_run)
+if dry_run:
+    exit()
+mover.run()
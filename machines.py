@@ -0,0 +1,168 @@
+"""
+machines.py - What we know about each machine that runs are submitted on.
+
+update_run_files.py and sweep.py use this to figure out which machine they're on from
+its hostname, check the partition, number of nodes, and walltime of a job against that
+partition's limits, and split each node's cores into MPI ranks and threads.
+
+Each machine has:
+- "hostnames": patterns (as used by fnmatch) that the hostname of its login nodes match
+- "launcher": the command used to start ART in the submit script, like "ibrun"
+- "submit_line" (optional): a regular expression matching the line of the submit
+  script that starts ART. By default, this is the launcher followed by ./art, with
+  any options in between, optionally run through remora.
+- "node_types": the number of cores and memory (in GB) of each kind of node
+- "partitions": the kind of node, maximum number of nodes, and maximum walltime (in
+  hours) of each partition
+
+The machines below are always available. To add a machine, or change one of these,
+put it in a JSON file with the same layout and set NEW_RUN_MACHINES to its path.
+Machines in that file replace the ones here with the same name.
+"""
+
+import fnmatch
+import json
+import os
+import re
+import socket
+
+default_machines = {
+    "stampede2": {
+        "hostnames": ["*stampede2*"],
+        "launcher": "ibrun",
+        "node_types": {
+            "knl": {"cores": 68, "memory": 96},
+            "skx": {"cores": 48, "memory": 192},
+        },
+        "partitions": {
+            "development": {"node_type": "knl", "max_nodes": 16, "max_hours": 2},
+            "normal": {"node_type": "knl", "max_nodes": 256, "max_hours": 48},
+            "large": {"node_type": "knl", "max_nodes": 2048, "max_hours": 48},
+            "long": {"node_type": "knl", "max_nodes": 32, "max_hours": 120},
+            "flat-quadrant": {"node_type": "knl", "max_nodes": 24, "max_hours": 48},
+            "skx-dev": {"node_type": "skx", "max_nodes": 4, "max_hours": 2},
+            "skx-normal": {"node_type": "skx", "max_nodes": 128, "max_hours": 48},
+            "skx-large": {"node_type": "skx", "max_nodes": 868, "max_hours": 48},
+        },
+    },
+    "frontera": {
+        "hostnames": ["*frontera*"],
+        "launcher": "ibrun",
+        "node_types": {"clx": {"cores": 56, "memory": 192}},
+        "partitions": {
+            "development": {"node_type": "clx", "max_nodes": 40, "max_hours": 2},
+            "normal": {"node_type": "clx", "max_nodes": 512, "max_hours": 48},
+            "large": {"node_type": "clx", "max_nodes": 2048, "max_hours": 48},
+            "long": {"node_type": "clx", "max_nodes": 64, "max_hours": 120},
+            "small": {"node_type": "clx", "max_nodes": 2, "max_hours": 48},
+        },
+    },
+    "anvil": {
+        "hostnames": ["*anvil*"],
+        "launcher": "mpirun",
+        "node_types": {
+            "milan": {"cores": 128, "memory": 256},
+            "milan-highmem": {"cores": 128, "memory": 1024},
+        },
+        "partitions": {
+            "debug": {"node_type": "milan", "max_nodes": 2, "max_hours": 2},
+            "standard": {"node_type": "milan", "max_nodes": 16, "max_hours": 96},
+            "wide": {"node_type": "milan", "max_nodes": 56, "max_hours": 12},
+            "highmem": {"node_type": "milan-highmem", "max_nodes": 1, "max_hours": 48},
+        },
+    },
+}
+
+
+class Partition(object):
+    """
+    One partition (queue) of a machine, and the nodes in it.
+    """
+
+    def __init__(self, name, cores, memory, max_nodes, max_hours):
+        self.name = name
+        self.cores = cores
+        self.memory = memory
+        self.max_nodes = max_nodes
+        self.max_hours = max_hours
+
+    def check_nodes(self, value):
+        if int(value) > self.max_nodes:
+            raise ValueError(f"{self.name} allows at most {self.max_nodes} nodes")
+
+    def check_walltime(self, value):
+        # this assumes the walltime has already been checked to be hours:min:sec
+        hours, minutes, seconds = [int(t) for t in value.split(":")]
+        if hours + minutes / 60 + seconds / 3600 > self.max_hours:
+            raise ValueError(f"{self.name} allows at most {self.max_hours} hours")
+
+
+class Machine(object):
+    """
+    One machine, with everything in its profile.
+    """
+
+    def __init__(self, name, profile):
+        self.name = name
+        self.hostnames = profile["hostnames"]
+        self.launcher = profile["launcher"]
+        default_submit_line = (
+            rf"(remora\s+)?{re.escape(self.launcher)}\s+(\S+\s+)*\./art\s"
+        )
+        self.submit_line = re.compile(profile.get("submit_line", default_submit_line))
+        self.partitions = dict()
+        for partition_name, limits in profile["partitions"].items():
+            node_type = profile["node_types"][limits["node_type"]]
+            self.partitions[partition_name] = Partition(
+                partition_name,
+                node_type["cores"],
+                node_type["memory"],
+                limits["max_nodes"],
+                limits["max_hours"],
+            )
+
+    def matches(self, hostname):
+        return any(fnmatch.fnmatch(hostname, pattern) for pattern in self.hostnames)
+
+    def partition(self, name):
+        """
+        rtype: Partition
+        """
+        if name not in self.partitions:
+            raise ValueError("This is not an acceptable queue")
+        return self.partitions[name]
+
+    def check_partition(self, value):
+        self.partition(value)
+
+
+_machines = None
+
+
+def load_machines():
+    """
+    Get all the machines we know about. They are only read once.
+
+    rtype: dict of {name: Machine}
+    """
+    global _machines
+    if _machines is None:
+        profiles = dict(default_machines)
+        if "NEW_RUN_MACHINES" in os.environ:
+            with open(os.environ["NEW_RUN_MACHINES"], "r") as in_file:
+                profiles.update(json.load(in_file))
+        _machines = {name: Machine(name, p) for name, p in profiles.items()}
+    return _machines
+
+
+def get_machine():
+    """
+    Get the machine we're on.
+
+    rtype: Machine
+    """
+    hostname = socket.gethostname()
+    for machine in load_machines().values():
+        if machine.matches(hostname):
+            return machine
+    raise RuntimeError("Machine not supported")
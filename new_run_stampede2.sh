@@ -3,17 +3,31 @@ set -e
 
 # arguments
 # 1 - home directory containing the defs.h file and argument 2
+# anything after that is passed to update_run_files.py, such as --yes or
+# --answers=<file> to run it without answering questions (see user_input.py)
 
 code_dir="$(dirname "$(readlink -f "$0")")" 
 home_dir=$1
 
 module load python3
 echo "Either enter the new value or just hit enter to leave it unchanged."
-python3 $code_dir/update_run_files.py $home_dir
+python3 $code_dir/update_run_files.py $home_dir "${@:2}"
 module reset
 module load gsl
+# only builds the code if defs.h, the code, or the modules changed (see build_cache.py).
+# python3 is only loaded to check that, so that make runs with just gsl as before.
+module load python3
+status=0
+python3 $code_dir/build_cache.py $home_dir restore || status=$?
+if [ $status -eq 3 ]; then
+    module unload python3
+    (cd $home_dir && make)
+    module load python3
+    python3 $code_dir/build_cache.py $home_dir save
+elif [ $status -ne 0 ]; then
+    exit $status
+fi
 cd $home_dir
-make
 
 # Then copy the submission script to $SCRATCH. It will handle creating the
 # directories there as appropriate
@@ -0,0 +1,156 @@
+"""
+plan.py - Estimates how long the work planned by the file moving scripts will take.
+
+handle_out_files.py, handle_halo_files.py, handle_runtime.py, and tar_outputs.py all
+figure out everything they will do before doing any of it. They print that plan with
+its total size and an estimate of how long it will take, and when passed 'dry_run' they
+stop there, so that big jobs can be scheduled for a quiet time.
+
+The estimates come from how fast the same kind of work went the last time it was done
+here, which is saved in throughput.json in the cache directory ($XDG_CACHE_HOME/new_run,
+or ~/.cache/new_run if that isn't set). Until something has been measured a rough guess
+is used instead, and the estimate says so. The speeds are for everything running at
+once, so they are most accurate when the number of workers or streams is the same.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+throughput_name = "throughput.json"
+
+# How fast each kind of work goes. Copies and transfers to Ranch depend on the amount
+# of data, while moves and links are metadata operations that depend on the number of
+# files. The speeds here are rough guesses used until something has been measured.
+kinds = {
+    "copy": {"unit": "bytes", "default": 200e6},
+    "link": {"unit": "files", "default": 100},
+    "move": {"unit": "files", "default": 100},
+    "ranch": {"unit": "bytes", "default": 100e6},
+}
+
+# anything faster than this is mostly overhead, so it isn't a useful measurement
+min_seconds = 1.0
+
+
+def cache_dir():
+    """
+    Get the directory where things are saved between runs of these scripts.
+
+    rtype: Path
+    """
+    base = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    directory = Path(base) / "new_run"
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def unique_temp_path(path):
+    """
+    Get a temporary name next to a file, unique to this process and thread, to write it
+    to before moving it into place.
+
+    rtype: Path
+    """
+    path = Path(path)
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def atomic_write_json(path, data, indent=4):
+    """
+    Write data to a JSON file. It's written to a temporary file first and then moved
+    into place, so an interruption can't leave a partial file behind, and a script
+    reading it at the same time never sees one.
+    """
+    temp_path = unique_temp_path(path)
+    try:
+        with open(temp_path, "w") as out_file:
+            json.dump(data, out_file, indent=indent)
+        os.replace(temp_path, path)
+    finally:
+        if temp_path.exists():
+            os.remove(temp_path)
+
+
+def format_bytes(n_bytes):
+    return f"{n_bytes / 1e9:.1f} GB"
+
+
+def format_time(seconds):
+    hours, seconds = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class Throughput(object):
+    """
+    How fast each kind of work went the last time it was measured.
+    """
+
+    def __init__(self):
+        self.path = cache_dir() / throughput_name
+        self.rates = self._read()
+
+    def _read(self):
+        # a file that can't be read is treated like nothing was measured, since these
+        # are only estimates
+        try:
+            with open(self.path, "r") as in_file:
+                return json.load(in_file)
+        except (OSError, ValueError):
+            return dict()
+
+    def estimate(self, kind, n_files, n_bytes):
+        """
+        Estimate how long some work will take.
+
+        rtype: tuple of (time in seconds, whether this is based on a measurement)
+        """
+        amount = n_bytes if kinds[kind]["unit"] == "bytes" else n_files
+        if kind in self.rates:
+            return amount / self.rates[kind]["rate"], True
+        return amount / kinds[kind]["default"], False
+
+    def record(self, kind, n_files, n_bytes, seconds):
+        """
+        Save how long some work took, to be used for later estimates.
+        """
+        amount = n_bytes if kinds[kind]["unit"] == "bytes" else n_files
+        if seconds < min_seconds or amount == 0:
+            return
+        # another script may have measured something since this was read
+        self.rates = self._read()
+        self.rates[kind] = {
+            "rate": amount / seconds,
+            "measured": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        atomic_write_json(self.path, self.rates)
+
+
+def print_estimate(work, throughput):
+    """
+    Print the total size of some work and how long it should take.
+
+    :param work: dictionary of {kind: (number of files, number of bytes)}
+    :param throughput: Throughput object to base the estimates on
+    """
+    total_bytes = 0
+    total_time = 0
+    all_measured = True
+    for kind, (n_files, n_bytes) in sorted(work.items()):
+        if n_files == 0:
+            continue
+        seconds, measured = throughput.estimate(kind, n_files, n_bytes)
+        total_bytes += n_bytes
+        total_time += seconds
+        all_measured = all_measured and measured
+        print(
+            f"    {kind}: {n_files} files, {format_bytes(n_bytes)}, "
+            f"about {format_time(seconds)}{'' if measured else ' (guessed)'}"
+        )
+    print(
+        f"Total: {format_bytes(total_bytes)}, about {format_time(total_time)}"
+        + ("" if all_measured else ", partly guessed since nothing was measured yet")
+    )
@@ -0,0 +1,574 @@
+"""
+ranch.py - Shared tools for sending tar files to Ranch, used by tar_outputs.py and
+tar_directory.py
+
+This holds the pexpect session used to send a tar file through ssh, as well as the
+manifest that keeps track of which tar files have already made it to Ranch, so that
+an interrupted transfer can be restarted without sending everything again.
+
+The tar stream is written by this script with the tarfile module, rather than by
+calling tar through the shell, so there is no limit on how many files can go into one
+tar file. Its checksum is calculated as it is sent. Ranch calculates the checksum of
+what it receives in the same ssh session, so we know that the tar file made it there
+intact without ever having to read it back from tape.
+
+The tar stream can also be compressed on its way, which is worth it for things like
+log directories and halo catalogs. This is done in chunks on several threads at once.
+Each chunk is a complete gzip or xz stream. Both formats allow streams to be
+concatenated, so the result can be unpacked as usual with `tar xzf` or `tar xJf`.
+
+While transfers are running, their speed and how long they have left are printed
+regularly, and the timing of each one is saved in ranch_transfers.log.
+"""
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import lzma
+import os
+import re
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+import pexpect
+import plan
+
+# Where our project lives on Ranch
+ranch_projects_dir = "/stornext/ranch_01/ranch/projects/TG-AST200017/"
+
+# name of the manifest file and the transfer log, which live in the directory the
+# script is run from
+manifest_name = "ranch_manifest.json"
+log_name = "ranch_transfers.log"
+
+
+# ======================================================================================
+#
+# Compression
+#
+# ======================================================================================
+def _compress_gzip(data):
+    # wbits of 31 makes zlib write the gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _compress_xz(data):
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=6)
+
+
+# the compression options, with the function to compress a chunk and the suffix to
+# add to the tar file name
+compressors = {
+    "gzip": (_compress_gzip, ".gz"),
+    "xz": (_compress_xz, ".xz"),
+}
+
+# Files that are already dense, so that compressing them isn't worth the time
+dense_suffixes = [".art"]
+
+
+def choose_compression(compression, file_sizes):
+    """
+    Decide whether a set of files is worth compressing.
+
+    If most of the bytes are in files that don't compress well, we skip compression.
+
+    :param compression: the compression requested, either "none" or one of the keys
+                        of `compressors`
+    :param file_sizes: dictionary of {filename: size in bytes} for the files that will
+                       go into the tar file
+    rtype: str, the compression to use
+    """
+    if compression == "none":
+        return "none"
+    if compression not in compressors:
+        raise ValueError(f"Compression not recognized: {compression}")
+
+    total_size = sum(file_sizes.values())
+    dense_size = sum(
+        size
+        for name, size in file_sizes.items()
+        if os.path.splitext(name)[1] in dense_suffixes
+    )
+    if total_size > 0 and dense_size / total_size > 0.5:
+        return "none"
+    return compression
+
+
+def compressed_name(name, compression):
+    if compression == "none":
+        return name
+    return name + compressors[compression][1]
+
+
+def compression_from_name(name):
+    """
+    Get the compression of a tar file from its name, as made by compressed_name.
+
+    rtype: str
+    """
+    for compression, (_, suffix) in compressors.items():
+        if name.endswith(suffix):
+            return compression
+    return "none"
+
+
+class ChunkedCompressor(object):
+    """
+    File-like object that compresses everything written to it on several threads,
+    writing the compressed chunks to the underlying file in order.
+    """
+
+    chunk_size = 16 * 1024**2
+
+    def __init__(self, out_file, compression, n_threads):
+        self.out_file = out_file
+        self.compress = compressors[compression][0]
+        self.n_threads = n_threads
+        self.executor = ThreadPoolExecutor(max_workers=n_threads)
+        self.buffer = bytearray()
+        self.pending = collections.deque()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self._submit(bytes(self.buffer[: self.chunk_size]))
+            del self.buffer[: self.chunk_size]
+        # don't let too many chunks pile up in memory
+        while len(self.pending) > 2 * self.n_threads:
+            self.out_file.write(self.pending.popleft().result())
+        return len(data)
+
+    def _submit(self, chunk):
+        self.pending.append(self.executor.submit(self.compress, chunk))
+
+    def close(self):
+        """
+        Compress whatever is left, and write out all the chunks.
+        """
+        if len(self.buffer) > 0:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while len(self.pending) > 0:
+            self.out_file.write(self.pending.popleft().result())
+        self.executor.shutdown()
+
+
+# ======================================================================================
+#
+# Sending things through ssh
+#
+# ======================================================================================
+class CountingWriter(object):
+    """
+    File-like object that counts the bytes written to it on their way to the
+    underlying file.
+    """
+
+    def __init__(self, out_file):
+        self.out_file = out_file
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.out_file.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+
+class HashingWriter(object):
+    """
+    File-like object that calculates the checksum of everything written to it on its
+    way to the underlying file.
+    """
+
+    def __init__(self, out_file):
+        self.out_file = out_file
+        self.hash = hashlib.sha256()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.out_file.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        self.out_file.flush()
+
+
+class Transfer(object):
+    """
+    Sends one tar file to Ranch, checking that what arrives there is intact.
+
+    The tar stream is written into a named pipe that ssh reads from. This is needed
+    because ssh asks for the password on the terminal that pexpect controls, so we
+    can't send the data through that terminal too.
+    """
+
+    # size of the reads from the files going into the tar file, and of the blocks
+    # written out to ssh
+    read_size = 16 * 1024**2
+    block_size = 4 * 1024**2
+
+    def __init__(self, name, members, remote_path, logfile, compression="none"):
+        self.name = name
+        self.members = members
+        self.remote_path = remote_path
+        self.logfile = logfile
+        self.compression = compression
+        # the stream going out to ssh, and the tar stream before compression
+        self.stream = None
+        self.tar_stream = None
+        self.start_time = None
+        self.end_time = None
+        self.local_digest = None
+        self.remote_digest = None
+        self.error = None
+
+    @property
+    def bytes_sent(self):
+        if self.stream is None:
+            return 0
+        return self.stream.bytes_written
+
+    @property
+    def bytes_read(self):
+        if self.tar_stream is None:
+            return 0
+        return self.tar_stream.bytes_written
+
+    def run(self, pwd):
+        """
+        Do the transfer. If anything went wrong, self.error will describe it.
+        """
+        self.start_time = time.time()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fifo = os.path.join(temp_dir, "tar_stream")
+            os.mkfifo(fifo)
+
+            # Use Stampede2 variables to point to Ranch. On Ranch we both save the
+            # file and calculate the checksum of what was received.
+            command = (
+                f'ssh ${{ARCHIVER}} "set -o pipefail; '
+                f'tee {self.remote_path} | sha256sum" < {fifo}'
+            )
+            # spawn the child process, and use the encoding argument to allow me to
+            # send the log to stdout. Set no timeout since the copying takes a while.
+            child = pexpect.spawn(
+                "/bin/bash", ["-c", command], encoding="utf-8", timeout=None
+            )
+            # set the output to the log (but not the input, since that has my password)
+            child.logfile_read = self.logfile
+
+            # then start writing the tar stream, which will wait until ssh is ready
+            write_errors = []
+            writer = threading.Thread(target=self._write, args=(fifo, write_errors))
+            writer.start()
+
+            # then enter the password. If the connection fails before asking for it,
+            # we'll get the EOF instead, and the exit status will tell us what happened
+            output = ""
+            if child.expect(["Password: ", pexpect.EOF]) == 0:
+                output += child.before
+                child.sendline(pwd)
+                # then wait for it to complete.
+                child.expect(pexpect.EOF)
+            output += child.before
+            child.close()
+
+            # If ssh died before opening the pipe, the writer is still waiting for
+            # someone to read it. Open it ourselves so the writer can finish.
+            if writer.is_alive():
+                try:
+                    os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+                except OSError:
+                    pass
+            writer.join()
+        self.end_time = time.time()
+
+        # Ranch prints the checksum in the usual sha256sum format
+        match = re.search(r"\b([0-9a-f]{64})\s+-", output)
+        if match is not None:
+            self.remote_digest = match.group(1)
+
+        if child.exitstatus != 0:
+            self.error = f"ssh failed with exit status {child.exitstatus}"
+        elif len(write_errors) > 0:
+            self.error = write_errors[0]
+        elif self.remote_digest is None:
+            self.error = "did not get a checksum from Ranch"
+        elif self.remote_digest != self.local_digest:
+            self.error = "checksum on Ranch does not match"
+
+    def _write(self, fifo, errors):
+        """
+        Write the tar stream into the pipe read by ssh.
+        """
+        try:
+            with open(fifo, "wb") as out_file:
+                self.stream = HashingWriter(out_file)
+                if self.compression == "none":
+                    sink = self.stream
+                else:
+                    sink = ChunkedCompressor(
+                        self.stream, self.compression, min(8, os.cpu_count())
+                    )
+                # "w|" writes the tar file as a stream, in blocks of bufsize. Use the
+                # GNU format to match what tar itself writes.
+                self.tar_stream = CountingWriter(sink)
+                with tarfile.open(
+                    fileobj=self.tar_stream,
+                    mode="w|",
+                    bufsize=self.block_size,
+                    format=tarfile.GNU_FORMAT,
+                    copybufsize=self.read_size,
+                ) as tar:
+                    for member in self.members:
+                        tar.add(member)
+                if sink is not self.stream:
+                    sink.close()
+            self.local_digest = self.stream.hash.hexdigest()
+        except (OSError, tarfile.TarError) as e:
+            errors.append(f"error sending tar stream: {e}")
+
+    def write_digest(self, directory):
+        """
+        Save the checksum next to where this was run from, in the sha256sum format.
+        """
+        digest_path = Path(directory) / f"{self.name}.sha256"
+        with open(digest_path, "w") as out_file:
+            out_file.write(f"{self.local_digest}  {self.name}\n")
+
+
+# ======================================================================================
+#
+# Reporting on how the transfers are going
+#
+# ======================================================================================
+class Progress(object):
+    """
+    Prints the speed, progress, and estimated time left of transfers while they are
+    running, and saves the timing of each one to the transfer log when it's done.
+
+    Sizes are based on the tar stream before it is compressed, so that they can be
+    compared to the size of the files going into it.
+    """
+
+    def __init__(self, sizes, directory, lock, interval=30):
+        """
+        :param sizes: dictionary of {tar file name: size in bytes} of everything that
+                      will be sent
+        :param directory: directory where the transfer log will be saved
+        :param lock: lock used around anything printed
+        :param interval: how often to print an update, in seconds
+        """
+        self.sizes = sizes
+        self.log_path = Path(directory) / log_name
+        self.print_lock = lock
+        self.interval = interval
+        self.active = dict()
+        self.finished_bytes = 0
+        self.summary = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.start_time = time.time()
+        self.reporter = threading.Thread(target=self._report_regularly, daemon=True)
+        self.reporter.start()
+
+    def started(self, transfer):
+        with self.lock:
+            self.active[transfer.name] = transfer
+
+    def finished(self, transfer):
+        with self.lock:
+            del self.active[transfer.name]
+            self.finished_bytes += self.sizes[transfer.name]
+            # if something went wrong the transfer may not have started or ended
+            start_time = transfer.start_time or time.time()
+            end_time = transfer.end_time or time.time()
+            elapsed = end_time - start_time
+            rate = transfer.bytes_read / max(elapsed, 1e-9)
+            status = "done" if transfer.error is None else f"FAILED: {transfer.error}"
+            line = (
+                f"{time.strftime('%Y-%m-%d %H:%M:%S')}  {transfer.name}  "
+                f"read {plan.format_bytes(transfer.bytes_read)}  "
+                f"sent {plan.format_bytes(transfer.bytes_sent)}  "
+                f"in {plan.format_time(elapsed)}  ({rate / 1e6:.1f} MB/s)  {status}"
+            )
+            self.summary.append(line)
+            with open(self.log_path, "a") as log:
+                log.write(line + "\n")
+
+    def report(self):
+        """
+        Print how each running transfer and the job as a whole are going.
+        """
+        now = time.time()
+        lines = []
+        with self.lock:
+            active_bytes = 0
+            for name, transfer in sorted(self.active.items()):
+                if transfer.start_time is None:
+                    continue
+                done = transfer.bytes_read
+                active_bytes += done
+                rate = done / max(now - transfer.start_time, 1e-9)
+                size = self.sizes[name]
+                lines.append(
+                    f"{name}: {100 * min(done / max(size, 1), 1):.1f}% of "
+                    f"{plan.format_bytes(size)} at {rate / 1e6:.1f} MB/s, "
+                    f"{self._eta(size - done, rate)} left"
+                )
+            total = sum(self.sizes.values())
+            done = self.finished_bytes + active_bytes
+            rate = done / max(now - self.start_time, 1e-9)
+            lines.append(
+                f"Total: {100 * min(done / max(total, 1), 1):.1f}% of "
+                f"{plan.format_bytes(total)} at {rate / 1e6:.1f} MB/s, "
+                f"{self._eta(total - done, rate)} left"
+            )
+        with self.print_lock:
+            print("\n".join(lines), flush=True)
+
+    @staticmethod
+    def _eta(bytes_left, rate):
+        if rate <= 0:
+            return "unknown time"
+        return plan.format_time(max(bytes_left, 0) / rate)
+
+    def _report_regularly(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        """
+        Stop the regular updates, and print the timing of everything.
+        """
+        self.stopped.set()
+        self.reporter.join()
+        with self.print_lock:
+            print(f"\nTransfer summary (also saved to {self.log_path}):")
+            for line in self.summary:
+                print(f"    {line}")
+
+
+# ======================================================================================
+#
+# Keeping track of what has been sent
+#
+# ======================================================================================
+class Manifest(object):
+    """
+    Record of the tar files sent to Ranch from a directory.
+
+    Each tar file has its location on Ranch, the files that go into it, its size,
+    how much of it has been sent, and its state, which is one of "planned",
+    "in progress", "done", or "failed". The manifest is written to disk every time
+    anything changes, so it is up to date even if the script gets killed.
+    """
+
+    def __init__(self, directory):
+        self.path = Path(directory) / manifest_name
+        # transfers can happen in several threads at once
+        self.lock = threading.Lock()
+        if self.path.is_file():
+            with open(self.path, "r") as in_file:
+                self.tarballs = json.load(in_file)["tarballs"]
+        else:
+            self.tarballs = dict()
+
+    def is_done(self, name, members, remote_path, contents=None):
+        """
+        Check whether a tar file with these exact contents already made it to Ranch.
+
+        :param contents: if given, the size and modification time of each file in it,
+                         as {path: [size, mtime]}. It only counts as done if these
+                         match what was recorded when it was sent.
+        """
+        with self.lock:
+            if name not in self.tarballs:
+                return False
+            tarball = self.tarballs[name]
+            return (
+                tarball["state"] == "done"
+                and tarball["remote_path"] == remote_path
+                and tarball["members"] == sorted(members)
+                and (contents is None or tarball.get("contents") == contents)
+            )
+
+    def done_members(self):
+        """
+        Get all files that are in tar files that already made it to Ranch.
+
+        rtype: set
+        """
+        with self.lock:
+            members = set()
+            for tarball in self.tarballs.values():
+                if tarball["state"] == "done":
+                    members.update(tarball["members"])
+            return members
+
+    def unfinished(self):
+        """
+        Get the tar files that were planned but haven't made it to Ranch.
+
+        rtype: dict of {name: dict with "remote_path", "members", and so on}
+        """
+        with self.lock:
+            return {
+                name: dict(tarball)
+                for name, tarball in self.tarballs.items()
+                if tarball["state"] != "done"
+            }
+
+    def remove(self, name):
+        """
+        Forget about a tar file that won't be sent.
+        """
+        with self.lock:
+            del self.tarballs[name]
+            self._write()
+
+    def plan(self, name, members, n_bytes, remote_path, contents=None):
+        """
+        Add a tar file that will be sent. This replaces anything that was there before
+        under this name, unless it already has these contents and is done.
+
+        :param contents: optionally, the size and modification time of each file in
+                         it, to check against later (see is_done)
+        """
+        if self.is_done(name, members, remote_path, contents):
+            return
+        with self.lock:
+            self.tarballs[name] = {
+                "remote_path": remote_path,
+                "members": sorted(members),
+                "bytes": n_bytes,
+                "bytes_sent": 0,
+                "state": "planned",
+                "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            if contents is not None:
+                self.tarballs[name]["contents"] = contents
+            self._write()
+
+    def update(self, name, state, **fields):
+        """
+        Change the state of a tar file, and optionally other fields, such as how much
+        of it was sent or its checksum.
+        """
+        with self.lock:
+            tarball = self.tarballs[name]
+            tarball["state"] = state
+            tarball.update(fields)
+            tarball["updated"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            self._write()
+
+    def _write(self):
+        plan.atomic_write_json(self.path, {"tarballs": self.tarballs}, indent=2)
@@ -0,0 +1,107 @@
+"""
+snapshot_catalog.py - Finds the simulation outputs and halo catalogs in a directory,
+and organizes them by scale factor.
+
+This understands the following filenames, where the scale factor comes after the "a":
+- continuous_a0.1234.art (and any other files of that output), which are the outputs
+  from ART. These have the kind "continuous".
+- halos_a0.1234.0.bin and out_a0.1234.list, which are the halo catalogs from
+  rockstar. These have the kinds "halos" and "out".
+"""
+
+import os
+import re
+from pathlib import Path
+
+_filename_pattern = re.compile(r"^(?P<kind>continuous|halos|out)_a(?P<scale>\d+\.\d+)")
+
+output_kinds = ["continuous"]
+halo_kinds = ["halos", "out"]
+
+
+def parse_filename(filename):
+    """
+    Get the kind of file and its scale factor from its name.
+
+    rtype: tuple of (kind, scale factor as written in the filename), or None if this
+           isn't an output or halo file.
+    """
+    match = _filename_pattern.match(filename)
+    if match is None:
+        return None
+    return match.group("kind"), match.group("scale")
+
+
+class SnapshotFile(object):
+    """
+    One file from an output or halo catalog.
+
+    The size is only looked up when it's used, since that takes a metadata call.
+    """
+
+    def __init__(self, entry, kind, label):
+        self.name = entry.name
+        self.path = Path(entry.path)
+        self.kind = kind
+        # the scale factor as written in the filename, which is used to name things
+        self.label = label
+        self.scale = float(label)
+        self._entry = entry
+
+    @property
+    def size(self):
+        # DirEntry holds on to the result, so this only hits the filesystem once
+        return self._entry.stat().st_size
+
+
+class SnapshotCatalog(object):
+    """
+    All the outputs or halo catalogs in a directory, found with a single pass over it.
+
+    The files are grouped by scale factor, and the scale factors are sorted, so that
+    the first and last ones can be found immediately.
+    """
+
+    def __init__(self, directory, kinds):
+        """
+        :param directory: directory to look in
+        :param kinds: list of the kinds of files to include, such as output_kinds or
+                      halo_kinds
+        """
+        self.directory = Path(directory)
+        self.files = dict()
+        self.labels = dict()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                parsed = parse_filename(entry.name)
+                if parsed is None or parsed[0] not in kinds:
+                    continue
+                file = SnapshotFile(entry, *parsed)
+                self.files.setdefault(file.scale, []).append(file)
+                self.labels.setdefault(file.scale, file.label)
+        self.scales = sorted(self.files)
+
+    def __len__(self):
+        return len(self.scales)
+
+    @property
+    def first(self):
+        return self.scales[0]
+
+    @property
+    def last(self):
+        return self.scales[-1]
+
+    def size(self, scale):
+        """
+        Get the total size of all files at one scale factor, in bytes.
+        """
+        return sum(file.size for file in self.files[scale])
+
+    def remove(self, scale):
+        """
+        Remove a scale factor from the catalog.
+        """
+        del self.files[scale]
+        del self.labels[scale]
+        self.scales.remove(scale)
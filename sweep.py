@@ -0,0 +1,316 @@
+"""
+sweep.py
+
+Sets up a grid of ART runs that differ in a few parameters, without answering the
+questions of update_run_files.py for each of them.
+
+Takes one required argument: the path to a JSON file describing the grid, such as:
+{
+    "template": "/work2/.../art_home",
+    "output": "/work2/.../sweep_dt",
+    "name": "dt",
+    "grid": {
+        "max-dt-myr": [1.0, 2.5, 5.0],
+        "#define num_refinement_levels": [10, 11]
+    },
+    "fixed": {"#SBATCH --time": "24:00:00"}
+}
+- "template" is a directory like the one passed to new_run_stampede2.sh, with the code,
+  defs.h, run/config.cfg, and run/submit.sh. It is not changed.
+- "output" is where the runs will be put. It can't be inside the template.
+- "name" is the start of the name of each run, and of its job.
+- "grid" has the values for each parameter. Every combination of them is one run.
+- "fixed" (optional) has values used for all runs.
+The parameters are the names of lines in update_run_files.parameters, and each value is
+checked the same way as it is there. The lines that depend on the number of refinement
+levels, and the cores per rank, are set automatically like they are there, but can also
+be set directly. The work directory and job name of each run are always set here.
+
+Each run gets its own directory in the output directory, with its own run/config.cfg and
+run/submit.sh, and a link to the ART executable. The code is only built once for each
+different defs.h, in the builds directory, and all runs with that defs.h use that build.
+Code that was already built before, by this or new_run_stampede2.sh, isn't built again
+(see build_cache.py). The builds are run at the same time, with the number at once
+passed as 'workers=N' (the default is 4). Load the modules needed to build ART before
+running this.
+
+The runs are not submitted. Instead, submit_all.sh is written in the output directory,
+which submits all of them from $SCRATCH like new_run_stampede2.sh does. What each run
+has is saved in sweep_runs.json in the output directory.
+"""
+
+import sys
+import json
+import hashlib
+import itertools
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import build_cache
+import machines
+import update_run_files as urf
+
+# the files that are made when building, which shouldn't be copied from the template
+build_products = ["*.o", "*.a", build_cache.binary_name, build_cache.key_name]
+
+# the parameters that are set for each run, so can't be in the grid file
+automatic_parameters = ["work_dir", "#SBATCH --job-name"]
+
+# parse the user options
+n_workers = 4
+grid_file = None
+for arg in sys.argv[1:]:
+    if arg.startswith("workers="):
+        n_workers = int(arg.split("=")[-1])
+    elif grid_file is None:
+        grid_file = Path(arg)
+    else:
+        raise ValueError(f"Argument not recognized: {arg}")
+if grid_file is None:
+    raise ValueError("Need the grid file!")
+
+with open(grid_file, "r") as in_file:
+    sweep = json.load(in_file)
+
+template_dir = Path(sweep["template"]).resolve()
+output_dir = Path(sweep["output"]).resolve()
+sweep_name = sweep["name"]
+grid = sweep["grid"]
+fixed = sweep.get("fixed", dict())
+
+machine = machines.get_machine()
+
+# ======================================================================================
+#
+# Check the grid before making anything
+#
+# ======================================================================================
+if template_dir in output_dir.parents or template_dir == output_dir:
+    raise ValueError("The output directory can't be inside the template.")
+for name in list(grid) + list(fixed):
+    if name not in urf.parameters:
+        raise ValueError(
+            f"Unknown parameter: {name}. Choose from: {', '.join(urf.parameters)}"
+        )
+    if name in automatic_parameters:
+        raise ValueError(f"{name} is set for each run, so it can't be in the grid.")
+    if name in grid and name in fixed:
+        raise ValueError(f"{name} can't be in both the grid and the fixed values.")
+# check the values now, so that nothing is made if any are wrong
+for name, values in list(grid.items()) + [(n, [v]) for n, v in fixed.items()]:
+    check = urf.make_check_line(name, machine)
+    for value in values:
+        if urf.parameters[name][1] != "none":
+            check.check_func(str(value))
+
+# make every combination of the grid
+grid_names = list(grid)
+runs = []
+for values in itertools.product(*[grid[name] for name in grid_names]):
+    run_parameters = dict(fixed)
+    run_parameters.update(zip(grid_names, values))
+    runs.append(run_parameters)
+
+# and check that each run fits in the limits of its partition
+template_submit_options = urf.get_submit_options(
+    urf.read_lines(template_dir / "run" / "submit.sh")
+)
+
+
+def cpus_per_task_for(run_parameters):
+    """
+    Get the cores per rank of a run, if its partition or ranks per node were changed
+    and it wasn't set directly. This checks that the ranks evenly use all the cores.
+
+    rtype: int, or None if the template's value is kept
+    """
+    if (
+        "#SBATCH --partition" not in run_parameters
+        and "#SBATCH --ntasks-per-node" not in run_parameters
+    ) or "#SBATCH --cpus-per-task" in run_parameters:
+        return None
+    partition = run_parameters.get(
+        "#SBATCH --partition", template_submit_options["partition"]
+    )
+    ranks_per_node = run_parameters.get(
+        "#SBATCH --ntasks-per-node", template_submit_options["ntasks-per-node"]
+    )
+    return urf.get_cpus_per_task(machine, partition, int(ranks_per_node))
+
+
+cpus_per_task = []
+for run_parameters in runs:
+    partition = machine.partition(
+        run_parameters.get("#SBATCH --partition", template_submit_options["partition"])
+    )
+    for name in ["#SBATCH --nodes", "#SBATCH --time"]:
+        value = run_parameters.get(name, template_submit_options[name.split("--")[-1]])
+        urf.make_check_line(name, machine, partition=partition).check_func(str(value))
+    cpus_per_task.append(cpus_per_task_for(run_parameters))
+
+n_digits = len(str(len(runs) - 1))
+run_names = [f"{sweep_name}_{idx:0{n_digits}d}" for idx in range(len(runs))]
+
+for run_name in run_names:
+    urf.test_name(run_name)
+    if (output_dir / run_name).exists():
+        raise RuntimeError(f"{output_dir / run_name} already exists!")
+
+
+# ======================================================================================
+#
+# Set up each run
+#
+# ======================================================================================
+def answers_for_file(run_parameters, file_kind):
+    """
+    Get the values of the parameters that belong to one of the files.
+
+    rtype: dict of {line name: value}
+    """
+    return {
+        name: value
+        for name, value in run_parameters.items()
+        if urf.parameters[name][0] == file_kind
+    }
+
+
+def update(file, answers):
+    checks = [urf.make_check_line(name, machine, str(v)) for name, v in answers.items()]
+    return urf.update_file(file, checks)
+
+
+def set_up_run(run_name, run_parameters, run_cpus_per_task):
+    """
+    Make the directory for one run, with its edited files.
+
+    :param run_cpus_per_task: the cores per rank to set, or None to leave it
+
+    rtype: str, the contents of its defs.h
+    """
+    run_dir = output_dir / run_name
+    run_dir.mkdir(parents=True)
+    shutil.copytree(template_dir / "run", run_dir / "run")
+    shutil.copy2(template_dir / "defs.h", run_dir / "defs.h")
+
+    # defs.h first, since the number of levels sets some of config.cfg
+    defs_answers = answers_for_file(run_parameters, "defs")
+    defs_lines = update(run_dir / "defs.h", defs_answers)
+
+    config_answers = dict()
+    levels_name = "#define num_refinement_levels"
+    if levels_name in defs_lines:
+        config_answers.update(
+            urf.level_answers(int(defs_lines[levels_name].split()[-1]))
+        )
+    config_answers.update(answers_for_file(run_parameters, "config"))
+    update(run_dir / "run" / "config.cfg", config_answers)
+
+    submit_answers = answers_for_file(run_parameters, "submit")
+    if run_cpus_per_task is not None:
+        submit_answers["#SBATCH --cpus-per-task"] = run_cpus_per_task
+    submit_answers["#SBATCH --job-name"] = run_name
+    submit_answers["work_dir"] = str(run_dir)
+    update(run_dir / "run" / "submit.sh", submit_answers)
+
+    with open(run_dir / "defs.h", "r") as in_file:
+        return in_file.read()
+
+
+defs_texts = dict()
+for run_name, run_parameters, run_cpus_per_task in zip(run_names, runs, cpus_per_task):
+    print(f"Setting up {run_name}: {run_parameters}")
+    defs_texts[run_name] = set_up_run(run_name, run_parameters, run_cpus_per_task)
+
+
+# ======================================================================================
+#
+# Build the code once for each different defs.h
+#
+# ======================================================================================
+def build_dir_for(defs_text):
+    digest = hashlib.sha256(defs_text.encode("utf-8")).hexdigest()
+    return output_dir / "builds" / digest[:12]
+
+
+def ignore_in_build(directory, names):
+    """
+    Which files in the template not to copy into a build: the run directory, and
+    anything that's made when building.
+    """
+    ignored = shutil.ignore_patterns(*build_products)(directory, names)
+    if Path(directory) == template_dir:
+        ignored.add("run")
+    return ignored
+
+
+def build(build_dir, defs_text):
+    """
+    Copy the code to its own directory with this defs.h, and build it there. If this
+    same code was built before, that build is used instead (see build_cache.py).
+
+    rtype: str, how it was built
+    """
+    if not build_dir.exists():
+        shutil.copytree(template_dir, build_dir, symlinks=True, ignore=ignore_in_build)
+        with open(build_dir / "defs.h", "w") as out_file:
+            out_file.write(defs_text)
+
+    with open(build_dir / "make.log", "w") as log:
+        try:
+            return build_cache.build(build_dir, log_file=log)
+        except RuntimeError as e:
+            raise RuntimeError(f"{e}, see {build_dir / 'make.log'}")
+
+
+builds = {build_dir_for(text): text for text in defs_texts.values()}
+print(f"\nBuilding {len(builds)} version(s) of the code for {len(runs)} runs")
+errors = []
+with ThreadPoolExecutor(max_workers=n_workers) as executor:
+    futures = {
+        executor.submit(build, build_dir, text): build_dir
+        for build_dir, text in builds.items()
+    }
+for future, build_dir in futures.items():
+    if future.exception() is not None:
+        errors.append(f"{build_dir}: {future.exception()}")
+    else:
+        print(f"{build_dir.name}: {future.result()}")
+if len(errors) > 0:
+    raise RuntimeError("\n".join(errors))
+
+# then point each run at its build
+for run_name in run_names:
+    (output_dir / run_name / build_cache.binary_name).symlink_to(
+        build_dir_for(defs_texts[run_name]) / build_cache.binary_name
+    )
+
+
+# ======================================================================================
+#
+# Write what was made, and how to submit it
+#
+# ======================================================================================
+summary = {
+    run_name: {
+        "parameters": run_parameters,
+        "build": str(build_dir_for(defs_texts[run_name])),
+    }
+    for run_name, run_parameters in zip(run_names, runs)
+}
+with open(output_dir / "sweep_runs.json", "w") as out_file:
+    json.dump(summary, out_file, indent=4)
+
+# Like new_run_stampede2.sh, this submits from $SCRATCH to reduce the file load on $WORK
+submit_all = output_dir / "submit_all.sh"
+with open(submit_all, "w") as out_file:
+    out_file.write("set -e\n")
+    out_file.write("cd $SCRATCH\n")
+    for run_name in run_names:
+        submit_file = output_dir / run_name / "run" / "submit.sh"
+        out_file.write(f"cp {submit_file} submit_{run_name}.sh\n")
+        out_file.write(f"sbatch submit_{run_name}.sh\n")
+submit_all.chmod(0o755)
+
+print(f"\nSet up {len(runs)} runs in {output_dir}")
+print(f"Submit them all with: bash {submit_all}")
@@ -0,0 +1,71 @@
+"""
+sync_state.py - Remembers what handle_out_files.py and handle_halo_files.py have
+already done for each run, so that running them again only looks at what's new.
+
+The state of each run is kept in .sync_state.json in its run directory. For each
+directory that gets handled (working_out or halos), this records the last scale factor
+that was processed and the modification time of the directory once everything was
+moved. Adding or removing files changes that time, so if it's the same the next time,
+nothing new has shown up and the directory doesn't need to be listed again. This only
+takes a single stat instead of listing everything, which matters on Lustre.
+
+This assumes the simulation isn't writing new files while these scripts run, which
+they already need since they keep the last output.
+"""
+
+import json
+from pathlib import Path
+import plan
+
+state_name = ".sync_state.json"
+
+
+class SyncState(object):
+    """
+    What has been done for one run, read from and written to .sync_state.json.
+    """
+
+    def __init__(self, run_dir):
+        self.path = Path(run_dir) / "run" / state_name
+        if self.path.is_file():
+            with open(self.path, "r") as in_file:
+                self.directories = json.load(in_file)
+        else:
+            self.directories = dict()
+
+    def is_unchanged(self, directory):
+        """
+        Whether nothing has been added to or removed from a directory since it was last
+        handled.
+        """
+        directory = Path(directory)
+        if directory.name not in self.directories:
+            return False
+        try:
+            mtime_ns = directory.stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+        return mtime_ns == self.directories[directory.name]["mtime_ns"]
+
+    def last_scale(self, directory):
+        """
+        Get the last scale factor that was handled in this directory.
+
+        rtype: str, as written in the filenames, or None if nothing has been handled
+        """
+        directory = Path(directory)
+        if directory.name not in self.directories:
+            return None
+        return self.directories[directory.name]["last_scale"]
+
+    def update(self, directory, last_scale):
+        """
+        Record that a directory has been handled, and save that to the file. This
+        should be called once everything has been moved out of it.
+        """
+        directory = Path(directory)
+        self.directories[directory.name] = {
+            "last_scale": last_scale,
+            "mtime_ns": directory.stat().st_mtime_ns,
+        }
+        plan.atomic_write_json(self.path, self.directories)
@@ -9,15 +9,32 @@ This takes the following arguments:
   the same as the current path, just modified for the different machine.
 - (optional) Whether or not to include the date in the directory name. To not include
   the date, pass 'no-date'.
-Note that these last two parameters can be in any order.
+- (optional) The compression to use, passed as 'compress=gzip' or 'compress=xz'.
+  If the directory is mostly .art files it won't be compressed, since those barely
+  compress at all.
+Note that these last parameters can be in any order.
+
+What has been sent is recorded in ranch_manifest.json in the current directory, along
+with the size and modification time of every file in it. If this directory already made
+it to Ranch and nothing in it has changed, running this again will not send it again.
+The checksum of the tar file is checked against what Ranch received, and saved in the
+current directory as <tar file>.sha256. The speed and time remaining are printed
+regularly while this runs, and the timing is saved in ranch_transfers.log.
+
+To run this without being asked, see user_input.py. The key used in the answers file
+is "execute".
 """
 
 import datetime
+import os
 import sys
 from pathlib import Path
-import getpass
-import pexpect
 import shutil
+from threading import Lock
+import ranch
+import user_input
+
+user_input.parse_batch_args()
 
 # as we parse the arguments we'll remove them, so remove the script name
 sys.argv.pop(0)
@@ -37,6 +54,14 @@ if "delete" in sys.argv:
     delete = True
     sys.argv.remove("delete")
 
+# if not specified, do not compress
+compression = "none"
+for arg in sys.argv:
+    if arg.startswith("compress="):
+        compression = arg.split("=")[-1]
+        sys.argv.remove(arg)
+        break
+
 # there should only be one item left
 if len(sys.argv) > 1:
     raise ValueError("Too many parameters!")
@@ -57,7 +82,31 @@ if dir_ranch_end is None:
     # on WORK there is an extra stampede2 term that I should remove
     this_dir = this_dir.replace("stampede2/", "")
     dir_ranch_end = this_dir.partition(stampede_username)[-1]
-dir_ranch = "/stornext/ranch_01/ranch/projects/TG-AST200017/" + dir_ranch_end
+dir_ranch = ranch.ranch_projects_dir + dir_ranch_end
+
+
+def get_file_stats(directory):
+    """
+    Get the size (in bytes) and modification time of all the files in a directory
+
+    rtype: dict of {path relative to the directory: [size, mtime]}
+    """
+    file_stats = dict()
+    for root, _, files in os.walk(directory):
+        for file in files:
+            path = os.path.join(root, file)
+            stat = os.lstat(path)
+            file_stats[os.path.relpath(path, directory)] = [
+                stat.st_size,
+                stat.st_mtime,
+            ]
+    return file_stats
+
+
+# see whether this is worth compressing
+file_stats = get_file_stats(dir_to_copy)
+file_sizes = {path: size for path, (size, _) in file_stats.items()}
+compression = ranch.choose_compression(compression, file_sizes)
 
 # also make the filename
 if add_date:
@@ -65,43 +114,59 @@ if add_date:
     file_name = f"{dir_to_copy.name}_{date}.tar"
 else:
     file_name = f"{dir_to_copy.name}.tar"
+file_name = ranch.compressed_name(file_name, compression)
 path_ranch = str(Path(dir_ranch) / file_name)
 
-def get_yn_input(prompt):
-    answer = input(prompt + " (y/n) ")
-    while answer.lower() not in ["y", "n"]:
-        answer = input("Enter y or n: ")
-
-    return answer == "y"
+# check whether this was already sent. This also checks the files in the directory,
+# so that if anything was added or changed since then, it's sent again (and not deleted)
+manifest = ranch.Manifest(Path("./").absolute())
+already_sent = manifest.is_done(
+    file_name, [dir_to_copy_raw], path_ranch, contents=file_stats
+)
 
 # Inform the user of what will happen
-print(f"\n{dir_to_copy}\nwill be transferred to:\n{path_ranch}")
+if already_sent:
+    print(f"\n{dir_to_copy}\nis already on Ranch at:\n{path_ranch}")
+else:
+    print(f"\n{dir_to_copy}\nwill be transferred to:\n{path_ranch}")
 if delete:
     print("========== THEN WILL BE DELETED! ==========")
 # Then ask them if they want to do this
-if not get_yn_input("\nDo you want to execute this?"):
+if not user_input.get_yn_input("\nDo you want to execute this?", key="execute"):
     print("exiting...")
     exit()
 
-# Ask the user for their password, will be used later
-pwd = getpass.getpass(prompt="Enter Ranch password: ")
-
-# then copy the files
-command = f"tar cf - {dir_to_copy_raw} "
-# Use Stampede2 variables to point to Ranch
-command += "| ssh ${ARCHIVER} "
-command += f'"cat > {path_ranch}"'
-# spawn the child process, and use the encoding argument to allow me to send the
-# log to stdout. Set no timeout since the copying takes a while.
-child = pexpect.spawn("/bin/bash", ["-c", command], encoding="utf-8", timeout=None)
-# set the output to stdout (but not the input, since that has my password)
-child.logfile_read = sys.stdout
-# then enter the password
-child.expect("Password: ")
-child.sendline(pwd)
-# then wait for it to complete.
-child.expect(pexpect.EOF)
-print("Done copying!")
+
+if not already_sent:
+    # Ask the user for their password, will be used later
+    pwd = user_input.get_password("Enter Ranch password: ")
+
+    # record this before we start, so we know if it gets interrupted
+    dir_size = sum(file_sizes.values())
+    manifest.plan(
+        file_name, [dir_to_copy_raw], dir_size, path_ranch, contents=file_stats
+    )
+
+    # then copy the files
+    transfer = ranch.Transfer(
+        file_name, [dir_to_copy_raw], path_ranch, sys.stdout, compression
+    )
+    manifest.update(file_name, "in progress")
+    # print updates on how things are going every so often
+    progress = ranch.Progress({file_name: dir_size}, Path("./").absolute(), Lock())
+    progress.started(transfer)
+    transfer.run(pwd)
+    progress.finished(transfer)
+    progress.stop()
+    if transfer.error is not None:
+        manifest.update(file_name, "failed", bytes_sent=transfer.bytes_sent)
+        # don't delete anything if the copy didn't work!
+        raise RuntimeError(f"Copying to Ranch failed: {transfer.error}")
+    transfer.write_digest(Path("./").absolute())
+    manifest.update(
+        file_name, "done", bytes_sent=transfer.bytes_sent, sha256=transfer.local_digest
+    )
+    print("Done copying!")
 
 def delete_folder(dir_to_delete):
     for item in dir_to_delete.iterdir():
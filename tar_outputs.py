@@ -5,28 +5,55 @@ This only works on Stampede2 right now, as it uses the $ARCHIVE environment vari
 
 This should be run from the directory where the outputs are. It will copy them to
 the same path on Ranch, so this directory needs to exist. 
+
+What has been sent is recorded in ranch_manifest.json in this directory. If the
+transfer gets interrupted, running this again will only send the tar files that did
+not make it to Ranch, with the same names and contents as before.
+
+This takes the following optional arguments:
+- The number of tar files to send to Ranch at the same time, passed as 'streams=N'.
+  Each one gets its own ssh connection. If not included, they are sent one at a time.
+- The compression to use, passed as 'compress=gzip' or 'compress=xz'. Tar files that
+  are mostly .art files are never compressed, since those barely compress at all. If
+  not included, nothing is compressed.
+- 'dry_run', to print what would be sent and how long it should take, then stop
+  before asking for the password.
 """
 
 import sys
 import os
+import math
+import time
 from pathlib import Path
-import getpass
-import pexpect
-
-# Ask the user for their password, will be used later
-pwd = getpass.getpass(prompt="Enter Ranch password: ")
-
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import plan
+import ranch
+import snapshot_catalog
+import user_input
 
-def get_yn_input(prompt):
-    answer = input(prompt + " (y/n) ")
-    while answer.lower() not in ["y", "n"]:
-        answer = input("Enter y or n: ")
+user_input.parse_batch_args()
 
-    return answer == "y"
+# parse the number of simultaneous transfers and the compression
+n_streams = 1
+compression = "none"
+dry_run = False
+for arg in sys.argv[1:]:
+    if arg.startswith("streams="):
+        n_streams = int(arg.split("=")[-1])
+    elif arg.startswith("compress="):
+        compression = arg.split("=")[-1]
+    elif arg == "dry_run":
+        dry_run = True
+    else:
+        raise ValueError(f"Argument not recognized: {arg}")
+if n_streams < 1:
+    raise ValueError("Need at least one stream!")
 
 
-# set the maximum size of the tar file before compression is done.
-max_size = 300e9  # 300 GB, in bytes
+# set the size we want the tar files to be, plus the size they can never go above.
+target_size = 300e9  # 300 GB, in bytes
+max_size = 350e9  # 350 GB, in bytes
 
 # Directory where the output files will be located
 this_dir = Path("./").absolute()
@@ -37,71 +64,178 @@ this_dir = Path("./").absolute()
 stampede_username = os.getlogin() + os.sep
 non_home_path = str(this_dir).partition(stampede_username)[-1]
 
-# first get a list of all the .art files, so I can make sure all files from a
-# given output stay together.
-art_file_stems = []
-for item in this_dir.iterdir():
-    if item.suffix == ".art":
-        art_file_stems.append(item.stem)
-# sort them, so I can group similar outputs in the same tar file
-art_file_stems = sorted(art_file_stems)
+
+# Find all the outputs here, grouped by scale factor, so I can make sure all files from
+# a given output stay together. Only outputs with a .art file are included.
+catalog = snapshot_catalog.SnapshotCatalog(this_dir, snapshot_catalog.output_kinds)
+for scale in list(catalog.scales):
+    if not any(file.name.endswith(".art") for file in catalog.files[scale]):
+        catalog.remove(scale)
+
+# Skip any outputs that already made it to Ranch in a previous run of this script
+manifest = ranch.Manifest(this_dir)
+done_files = manifest.done_members()
+for scale in list(catalog.scales):
+    if all(file.name in done_files for file in catalog.files[scale]):
+        print(f"The output at a = {catalog.labels[scale]} is already on Ranch.")
+        catalog.remove(scale)
+
+# Tar files that were started before but didn't make it are sent again with the same
+# name and contents, so that they replace any partial copy left on Ranch. Only the
+# outputs that aren't in any of them are grouped again below.
+remote_dir = f"{ranch.ranch_projects_dir}{non_home_path}"
+resumed_groups = dict()
+# the ones that can't be sent again are only removed from the manifest once we know
+# this isn't a dry run
+dropped_groups = []
+for name, tarball in sorted(manifest.unfinished().items()):
+    members = tarball["members"]
+    if tarball["remote_path"] != f"{remote_dir}/{name}" or not all(
+        (this_dir / member).is_file() for member in members
+    ):
+        print(
+            f"{name} was not finished, but its files are no longer all here. Check "
+            f"for a partial copy on Ranch at {tarball['remote_path']}."
+        )
+        dropped_groups.append(name)
+        continue
+    print(f"{name} was not finished, and will be sent again.")
+    resumed_groups[name] = members
+    for scale in list(catalog.scales):
+        if all(file.name in members for file in catalog.files[scale]):
+            catalog.remove(scale)
+
+if len(catalog) == 0 and len(resumed_groups) == 0:
+    print("Everything here is already on Ranch!")
+    exit()
 
 # Ask them if they want to include the first output, it may already be in the tar file
 # from the previous operation, since it's needed to restart the next run
-print(f"The earliest output here is {art_file_stems[0]}.")
-if not get_yn_input("Do you want to include it?"):
-    art_file_stems = art_file_stems[1:]
-
-# then group them. We want tar files around the size of max_size above. What we
-# do is to go through the sorted outputs, adding them to a group one by one,
-# keeping track of the size as we go. If it gets above 500GB, we make a new
-# group. Each of these individual groups will be turned into a tar file later.
-accumulated_size = 0
-file_groups = [[]]
-for stem in art_file_stems:
-    # check if we need to start a new set of outputs
-    if accumulated_size > max_size:
-        accumulated_size = 0
-        file_groups.append([])
-
-    # add the outputs to the tar file.
-    for other_file in this_dir.iterdir():
-        if other_file.stem == stem:
-            accumulated_size += other_file.stat().st_size
-            file_groups[-1].append(other_file.name)
+if len(catalog) > 0:
+    print(f"The earliest output here is at a = {catalog.labels[catalog.first]}.")
+    if not user_input.get_yn_input("Do you want to include it?", key="include_first"):
+        catalog.remove(catalog.first)
 
-# Make the filenames of the tar files. I'll name the tar file based on the
-# outputs that it contains.
-def file_to_scale(file_name):
-    suffix = file_name.split(".")[-1]
-    file_name = file_name.replace("." + suffix, "")
-    return file_name.split("_")[-1]
 
+# then group them. We want tar files around the size of target_size above, and never
+# above max_size, with all of them about the same size. Each group is a contiguous
+# set of outputs, so each tar file holds a range of scale factors. The best way to
+# split the outputs is found by dynamic programming over the sorted outputs.
+def pack_outputs(sizes, target_size, max_size):
+    """
+    Split a list of output sizes into contiguous groups.
 
-named_groups = dict()
-for group in file_groups:
-    # get the range of scale factors included in this tar file.
-    min_scale = file_to_scale(min(group))
-    max_scale = file_to_scale(max(group))
+    The groups minimize the sum of the squared differences between the size of each
+    group and the target size, without any group going above max_size. An output
+    that is larger than max_size by itself gets a group to itself.
+
+    rtype: list of lists of indices into sizes
+    """
+    n = len(sizes)
+    # best_cost[i] is the lowest cost of packing the first i outputs, and
+    # group_start[i] is where the last group of that packing starts
+    best_cost = [0.0] + [math.inf] * n
+    group_start = [0] * (n + 1)
+    for end in range(1, n + 1):
+        group_size = 0
+        for start in range(end - 1, -1, -1):
+            group_size += sizes[start]
+            if group_size > max_size and start < end - 1:
+                break
+            cost = best_cost[start] + (group_size - target_size) ** 2
+            if cost < best_cost[end]:
+                best_cost[end] = cost
+                group_start[end] = start
 
-    if min_scale == max_scale:
-        tar_name = f"outputs_{min_scale}.tar"
+    # then go backwards through the packing to get the groups themselves
+    groups = []
+    end = n
+    while end > 0:
+        start = group_start[end]
+        groups.insert(0, list(range(start, end)))
+        end = start
+    return groups
+
+
+# the catalog keeps the outputs sorted, so I can group similar outputs in the same tar
+# file
+scale_sizes = [catalog.size(scale) for scale in catalog.scales]
+file_groups = []
+group_sizes = []
+group_labels = []
+for group in pack_outputs(scale_sizes, target_size, max_size):
+    group_scales = [catalog.scales[idx] for idx in group]
+    file_groups.append(
+        [file.name for scale in group_scales for file in catalog.files[scale]]
+    )
+    group_sizes.append(sum(scale_sizes[idx] for idx in group))
+    # keep the range of scale factors included in this tar file, to name it later
+    group_labels.append(
+        (catalog.labels[group_scales[0]], catalog.labels[group_scales[-1]])
+    )
+
+# we'll also want the size of each file individually
+file_size = dict()
+for scale in catalog.scales:
+    for file in catalog.files[scale]:
+        file_size[file.name] = file.size
+
+# Make the filenames of the tar files. I'll name the tar file based on the
+# outputs that it contains.
+named_groups = dict()
+named_group_sizes = dict()
+named_group_compression = dict()
+for group, group_size, (min_label, max_label) in zip(
+    file_groups, group_sizes, group_labels
+):
+    if min_label == max_label:
+        tar_name = f"outputs_a{min_label}.tar"
     else:
-        tar_name = f"outputs_{min_scale}_to_{max_scale}.tar"
+        tar_name = f"outputs_a{min_label}_to_a{max_label}.tar"
+
+    # see whether this is worth compressing
+    file_sizes = {file: file_size[file] for file in group}
+    group_compression = ranch.choose_compression(compression, file_sizes)
+    tar_name = ranch.compressed_name(tar_name, group_compression)
 
     named_groups[tar_name] = sorted(group)
+    named_group_sizes[tar_name] = group_size
+    named_group_compression[tar_name] = group_compression
+
+# along with the ones we're sending again
+for tar_name, members in resumed_groups.items():
+    named_groups[tar_name] = sorted(members)
+    named_group_sizes[tar_name] = sum(os.stat(this_dir / m).st_size for m in members)
+    named_group_compression[tar_name] = ranch.compression_from_name(tar_name)
+
+# Use Stampede2 variables to point to Ranch
+remote_paths = {name: f"{remote_dir}/{name}" for name in named_groups}
 
 # Inform the user of what will happen
 for key in sorted(named_groups.keys()):
-    print(f"\n{key} will contain:")
+    print(f"\n{key} ({named_group_sizes[key] / 1e9:.1f} GB) will contain:")
     for file in named_groups[key]:
         if file.endswith(".art"):
             print(f"    - {file}")
+# along with how long it should take
+throughput = plan.Throughput()
+print()
+plan.print_estimate(
+    {"ranch": (len(named_groups), sum(named_group_sizes.values()))}, throughput
+)
+if dry_run:
+    exit()
 # Then ask them if they want to do this
-if not get_yn_input("\nDo you want to execute this?"):
+if not user_input.get_yn_input("\nDo you want to execute this?", key="execute"):
     print("exiting...")
     exit()
 
+for name in dropped_groups:
+    manifest.remove(name)
+
+# Ask the user for their password, will be used later
+pwd = user_input.get_password("Enter Ranch password: ")
+
 # Then we can make the tar files themselves.
 # for name in tqdm(named_groups):
 #     tar = tarfile.open(name=this_dir / name, mode="x")
@@ -109,25 +243,117 @@ if not get_yn_input("\nDo you want to execute this?"):
 #         tar.add(file)
 #     tar.close()
 
-for name in named_groups:
-    command = "tar cf - "
-    for file in named_groups[name]:
-        command += file
-        command += " "
-    # Use Stampede2 variables to point to Ranch
-    command += (
-        '| ssh ${ARCHIVER} "cat > /stornext/ranch_01/ranch/projects/TG-AST200017/'
+# Each group is sent through its own ssh connection, with several of them going at
+# once. Their output is labeled with the name of the tar file, so that it can be told
+# apart when several are printing at the same time.
+class LabeledLog(object):
+    def __init__(self, label, lock):
+        self.label = label
+        self.lock = lock
+        self.partial_line = ""
+
+    def write(self, text):
+        lines = (self.partial_line + text.replace("\r", "")).split("\n")
+        # hold on to anything after the last newline until the line is finished
+        self.partial_line = lines.pop()
+        with self.lock:
+            for line in lines:
+                sys.stdout.write(f"[{self.label}] {line}\n")
+
+    def flush(self):
+        # pexpect calls this after every write, so an unfinished line is kept until
+        # it's finished or this is closed
+        sys.stdout.flush()
+
+    def close(self):
+        """
+        Write out anything left after the last newline, once nothing else is coming.
+        """
+        if len(self.partial_line) > 0:
+            self.write("\n")
+        sys.stdout.flush()
+
+
+print_lock = threading.Lock()
+
+
+def transfer_group(name, files):
+    """
+    Tar a group of files and send it to Ranch.
+
+    rtype: str, describing what went wrong, or None if it worked
+    """
+    log = LabeledLog(name, print_lock)
+    transfer = ranch.Transfer(
+        name, files, remote_paths[name], log, named_group_compression[name]
     )
-    command += f'{non_home_path}/{name}"'
-    # spawn the child process, and use the encoding argument to allow me to send the
-    # log to stdout. Set no timeout since the copying takes a while.
-    child = pexpect.spawn("/bin/bash", ["-c", command], encoding="utf-8", timeout=None)
-    # set the output to stdout (but not the input, since that has my password)
-    child.logfile_read = sys.stdout
-    # then enter the password
-    child.expect("Password: ")
-    child.sendline(pwd)
-    # then wait for it to complete.
-    child.expect(pexpect.EOF)
+    manifest.update(name, "in progress")
+    progress.started(transfer)
+    try:
+        transfer.run(pwd)
+    except BaseException as e:
+        # if the transfer itself crashed, it never got to set its error
+        transfer.error = repr(e)
+        log.close()
+        progress.finished(transfer)
+        manifest.update(name, "failed", bytes_sent=transfer.bytes_sent)
+        raise
+    log.close()
+    # only record this as done if we know what was sent, since done tar files are
+    # never sent again
+    if transfer.error is None and transfer.local_digest is None:
+        transfer.error = "did not get a checksum of the tar stream"
+    progress.finished(transfer)
+    if transfer.error is None:
+        transfer.write_digest(this_dir)
+        manifest.update(
+            name,
+            "done",
+            bytes_sent=transfer.bytes_sent,
+            sha256=transfer.local_digest,
+        )
+    else:
+        manifest.update(name, "failed", bytes_sent=transfer.bytes_sent)
+    return transfer.error
+
+
+# record what we're about to do, so this can be picked back up if it gets interrupted
+for name in named_groups:
+    manifest.plan(name, named_groups[name], named_group_sizes[name], remote_paths[name])
+
+# print updates on how things are going every so often
+progress = ranch.Progress(named_group_sizes, this_dir, print_lock)
+
+failures = dict()
+n_finished = 0
+start_time = time.time()
+with ThreadPoolExecutor(max_workers=n_streams) as executor:
+    futures = {
+        executor.submit(transfer_group, name, named_groups[name]): name
+        for name in named_groups
+    }
+    for future in as_completed(futures):
+        name = futures[future]
+        try:
+            error = future.result()
+        except Exception as e:
+            failures[name] = repr(e)
+        else:
+            if error is not None:
+                failures[name] = error
+        n_finished += 1
+        with print_lock:
+            status = "FAILED" if name in failures else "done"
+            print(f"{name}: {status} ({n_finished}/{len(futures)} finished)")
+elapsed = time.time() - start_time
 
+# Then report how everything went
+progress.stop()
+if len(failures) > 0:
+    print(f"\n{len(failures)} of {len(named_groups)} tar files failed:")
+    for name in sorted(failures):
+        print(f"    - {name}: {failures[name]}")
+    sys.exit(1)
+# save how fast this was for later estimates
+throughput.record("ranch", len(named_groups), sum(named_group_sizes.values()), elapsed)
 print("Done!")
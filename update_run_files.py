@@ -8,30 +8,37 @@ Takes 4 required parameters:
 - filename of the submission script
 - filename of the config file
 - Either "slurm" or "torque" to denote the structure of the submit script
+
+To run this without being asked, see user_input.py. The keys used in the answers file
+are the names of the lines being checked (e.g. "max-dt-myr" or "#SBATCH --time"), plus
+"partition", "ranks_per_node", and "submission_stampede2" (the scale factor to restart
+from). Anything not in the answers file keeps its current value if '--yes' is used.
+
+Before asking for the number of MPI ranks per node, this lists every way to split the
+cores of the chosen nodes into ranks and threads, ranked by a rough model of how well
+ART runs with each (see Layout below). The best one with enough memory per rank is the
+default answer. When run without anyone there ('--yes', or an answers file without
+"ranks_per_node"), the current value in the submit script is kept instead, so that a
+rerun never changes it unasked. The model hasn't been calibrated against real ART runs,
+so its constants (threaded_fraction, communication_cost, memory_per_rank_overhead, and
+min_memory_per_rank) are guesses meant to be tuned.
+
+The machine is found from the hostname, and the partition, number of nodes, and
+walltime are checked against what that machine allows (see machines.py).
+
+This can also be imported to edit these files from other scripts, such as sweep.py.
+The lines that can be changed and the types of their values are in parameters below.
 """
 
 import sys
 from pathlib import Path
-import socket
 import shutil
-import filecmp
 import re
 import os
+import math
+import machines
+import user_input
 
-# check arguments provided
-if len(sys.argv) != 2:
-    raise RuntimeError("Incorrect number of arguments provided to update_run_files.py")
-
-home_dir = Path(sys.argv[1]).resolve()
-defs_file = home_dir / "defs.h"
-config_file = home_dir / "run" / "config.cfg"
-submit_file = home_dir / "run" / "submit.sh"
-
-hostname = socket.gethostname()
-if "stampede2" in hostname:
-    machine = "stampede2"
-else:
-    raise RuntimeError("Machine not supported")
 
 # ======================================================================================
 #
@@ -81,46 +88,6 @@ def test_name(value):
         raise ValueError("Slashes are not allowed here.")
 
 
-def test_queue_pleiades(value):
-    if value not in ["long", "normal", "devel", "debug"]:
-        raise ValueError("This is not an acceptable queue")
-
-
-def test_queue_stampede2(value):
-    if value not in [
-        "development",
-        "normal",
-        "large",
-        "long",
-        "flat-quadrant",
-        "skx-dev",
-        "skx-normal",
-        "skx-large",
-    ]:
-        raise ValueError("This is not an acceptable queue")
-
-
-def test_queue_frontera(value):
-    if value not in [
-        "development",
-        "normal",
-        "large",
-        "long",
-        "small",
-    ]:
-        raise ValueError("This is not an acceptable queue")
-
-
-def test_queue_anvil(value):
-    if value not in [
-        "debug",
-        "standard",
-        "wide",
-        "highmem",
-    ]:
-        raise ValueError("This is not an acceptable queue")
-
-
 def test_walltime(value):
     # First we'll check that is has an hours, minutes, seconds fields
     time_segments = value.split(":")
@@ -150,8 +117,6 @@ test_dict = {
     "dir": test_dir,
     "epochs": test_epochs,
     "name": test_name,
-    "queue_pleiades": test_queue_pleiades,
-    "queue_stampede2": test_queue_stampede2,
     "walltime": test_walltime,
     "none": lambda: True,
 }
@@ -174,7 +139,7 @@ def edit_line(original_line, separator, test_func, answer=None):
         old_value = original_line.split(separator)[-1].strip()
     # then get the new value. if answer is provided, we do not need to ask
     if answer is None:
-        answer = input("{}: ".format(original_line.strip()))
+        answer = user_input.get_input("{}: ".format(original_line.strip()))
     # then parse the answer as usual
     if len(answer) == 0:  # don't change anything
         # if we have a directory I want to check that it exists even if we
@@ -218,7 +183,9 @@ def __edit_line_refinement_level(kind, original_line, test_func, answer):
 
     # get the desired answer
     if answer is None:
-        answer = input(f"DM Lagrangian Refinement to-level={old_value}: ")
+        answer = user_input.get_input(
+            f"DM Lagrangian Refinement to-level={old_value}: "
+        )
         if len(answer) == 0:
             answer = old_value
     test_func(answer)
@@ -239,17 +206,20 @@ def edit_line_submission_stampede2(original_line, separator, test_func, answer=N
     The only changes are the config filename and the restart file, as the
     node/core info is handled by ibrun
     """
-    # first see if the user is using remora
-    if original_line.split()[0] == "remora":
-        remora = 1
-    else:
-        remora = 0
-
-    # Then we can edit the place to start the sim
+    # Find the place to start the sim. It's found by its option rather than its
+    # position, since that depends on the launcher and whether remora is used.
     # note that "-root" is used exclusively for initial conditions, while
     # "-r" is used when resuming from another snapshot
-    old_restart = original_line.split()[3 + remora]
-    answer = input("{} ->  -r=".format(old_restart))
+    restart_options = [
+        word
+        for word in original_line.split()
+        if word.startswith("-r=") or word.startswith("-root")
+    ]
+    if len(restart_options) == 0:
+        raise ValueError(f"No restart option in: {original_line.strip()}")
+    old_restart = restart_options[0]
+    if answer is None:
+        answer = user_input.get_input("{} ->  -r=".format(old_restart))
     if len(answer) == 0:
         new_restart = old_restart
     else:
@@ -267,206 +237,461 @@ def edit_line_submission_stampede2(original_line, separator, test_func, answer=N
 # --------------------------------------------------------------------------------------
 # Class that contains info on lines that can be easily modified
 # --------------------------------------------------------------------------------------
+_word_separator = re.compile(r"[\s=]+")
+
+
+def line_key(line):
+    """
+    Get what identifies a line: its first word, or its first two words for directives
+    like "#define num_refinement_levels" or "#SBATCH --time". Words are separated by
+    whitespace or "=".
+    """
+    words = _word_separator.split(line.strip(), maxsplit=2)
+    if words[0].startswith("#"):
+        return " ".join(words[:2])
+    return words[0]
+
+
 class CheckLine(object):
-    def __init__(self, name, dtype, answer=None, separator=" "):
+    def __init__(self, name, dtype, answer=None, separator=" ", submit_line=None):
         self.name = name
         self.separator = separator
-        self.check_func = test_dict[dtype]
+        # the type is either a key of test_dict, or a function to check the value
+        if callable(dtype):
+            self.check_func = dtype
+        else:
+            self.check_func = test_dict[dtype]
+        # Lines are found by their key. A few lines share a key with others, so they
+        # also need a condition to pick out the right one.
+        self.condition = None
         if self.name == "dm_lagrangian_to_level":
             self.edit_line_func = edit_line_refinement_to_level
+            self.key = "refinement"
+            self.condition = lambda line: "id=0" in line
         elif self.name == "jeans_from_level":
             self.edit_line_func = edit_line_refinement_from_level
+            self.key = "refinement"
+            self.condition = lambda line: "id=8" in line
         elif self.name == "submission_stampede2":
+            # this line can start with remora or the launcher, so it's checked
+            # against every line
             self.edit_line_func = edit_line_submission_stampede2
+            self.key = None
+            if submit_line is None:
+                submit_line = re.compile(r"(remora\s+)?ibrun\s+\./art\s")
+            self.condition = lambda line: submit_line.match(line) is not None
         else:
             self.edit_line_func = edit_line
+            self.key = line_key(self.name)
 
+        # answers given ahead of time in the answers file are used if we don't
+        # already have one
+        if answer is None:
+            answer = user_input.lookup(name)
         self.answer = answer
         if self.answer is not None:
             self.answer = str(self.answer)
 
     def check_line_match(self, line):
-        if self.name == "dm_lagrangian_to_level":
-            return line.startswith("refinement") and "id=0" in line
-        elif self.name == "jeans_from_level":
-            return line.startswith("refinement") and "id=8" in line
-        elif self.name == "submission_stampede2":
-            return line.startswith("ibrun ./art")
-        return line.startswith(self.name)
+        if line_key(line) != self.key:
+            return False
+        return self.condition is None or self.condition(line)
 
 
 # --------------------------------------------------------------------------------------
 # master function to run this editing
 # --------------------------------------------------------------------------------------
-def update_file(old_file, lines_to_update):
-    new_file = Path(str(old_file) + ".temp")
+def read_lines(file):
+    with open(file, "r") as in_file:
+        return in_file.readlines()
 
-    with open(old_file, "r") as in_file:
-        with open(new_file, "w") as out_file:
-            for line in in_file:
-                match = None
-                for start in lines_to_update:
-                    if start.check_line_match(line):
-                        match = start
-
-                if match is not None:
-                    # A few of these have special formats that have to be
-                    # checked separately
-                    new_line = match.edit_line_func(
-                        line, match.separator, match.check_func, match.answer
-                    )
-                    out_file.write(new_line)
-                else:  # not a line of interest, don't change it
-                    out_file.write(line)
-
-    # if the files are the same delete the new one, but if they are different
-    # replace the old with the new
-    files_same = filecmp.cmp(old_file, new_file)
-    if not files_same:
+
+def update_file(old_file, lines_to_update, old_lines=None):
+    """
+    Edit all the lines of interest in a file.
+
+    Each line is looked up by its key, so the file is only gone through once no matter
+    how many lines are being checked. All the edits are made in memory, and the file is
+    only replaced if something changed.
+
+    :param old_file: file to edit
+    :param lines_to_update: list of CheckLine objects
+    :param old_lines: the lines of this file, if it has already been read
+    rtype: dict of {CheckLine name: the line after editing}
+    """
+    if old_lines is None:
+        old_lines = read_lines(old_file)
+
+    checks_by_key = dict()
+    for check in lines_to_update:
+        checks_by_key.setdefault(check.key, []).append(check)
+
+    # the ones without a key are checked against every line
+    unkeyed_checks = checks_by_key.pop(None, [])
+
+    new_lines = []
+    matched_lines = dict()
+    for line in old_lines:
+        match = None
+        for check in checks_by_key.get(line_key(line), []) + unkeyed_checks:
+            if check.condition is None or check.condition(line):
+                match = check
+
+        if match is not None:
+            # A few of these have special formats that have to be
+            # checked separately
+            new_line = match.edit_line_func(
+                line, match.separator, match.check_func, match.answer
+            )
+            new_lines.append(new_line)
+            matched_lines[match.name] = new_line
+        else:  # not a line of interest, don't change it
+            new_lines.append(line)
+
+    # anything we were asked to change but couldn't find is left as it was, which
+    # shouldn't happen quietly
+    for check in lines_to_update:
+        if check.name not in matched_lines:
+            print(f"WARNING: no line for {check.name} in {old_file}, not changing it")
+
+    # if anything changed, write the new version to a temporary file and swap it in,
+    # so that the file is never left half written. Keep the permissions, since the
+    # submit script needs to stay executable.
+    if new_lines != old_lines:
         print("\nReplacing {}".format(old_file))
-        shutil.copy2(new_file, old_file)
-    # remove the new one regardless, since we copied earlier
-    os.remove(new_file)
+        new_file = Path(str(old_file) + ".temp")
+        with open(new_file, "w") as out_file:
+            out_file.writelines(new_lines)
+        shutil.copymode(old_file, new_file)
+        os.replace(new_file, old_file)
+    return matched_lines
 
 
 # ======================================================================================
 #
-# Update defs.h
+# The lines that can be changed
 #
 # ======================================================================================
-print_header(defs_file)
+# Every line that can be changed, with the file it's in and the type of its value. The
+# type is a key of test_dict, or "queue" for the partitions of the machine we're on.
+parameters = {
+    "#define num_refinement_levels": ("defs", "int"),
+    "auni-stop": ("config", "float"),
+    "max-dark-matter-level": ("config", "int"),
+    "sf:min-level": ("config", "int"),
+    "dm_lagrangian_to_level": ("config", "int"),
+    "jeans_from_level": ("config", "int"),
+    "reduce-timestep-factor:deep-decrement": ("config", "float"),
+    "reduce-timestep-factor:shallow-decrement": ("config", "float"),
+    "tolerance-for-timestep-increase": ("config", "float"),
+    "max-timestep-increment": ("config", "float"),
+    "min-timestep-decrement": ("config", "float"),
+    "max-dt-myr": ("config", "float"),
+    "time-refinement-factor:max": ("config", "int"),
+    "#SBATCH --job-name": ("submit", "name"),
+    "#SBATCH --partition": ("submit", "queue"),
+    "#SBATCH --ntasks-per-node": ("submit", "int"),
+    "#SBATCH --cpus-per-task": ("submit", "int"),
+    "#SBATCH --time": ("submit", "walltime"),
+    "#SBATCH --nodes": ("submit", "int"),
+    "submission_stampede2": ("submit", "none"),
+    "work_dir": ("submit", "dir"),
+}
 
-defs_updates = [CheckLine("#define num_refinement_levels", "int")]
-update_file(defs_file, defs_updates)
 
-# Then go through and find the newly calculated level, so we can grab it and use it to
-# calculate some other quantities of interest used later
-with open(defs_file, "r") as in_file:
-    for line in in_file:
-        if line.startswith(defs_updates[0].name):
-            num_levels = int(line.split()[-1])
-            break
+def make_check_line(name, machine, answer=None, partition=None):
+    """
+    Make the CheckLine for one of the lines in parameters.
 
-# ======================================================================================
-#
-# Update config.cfg
-#
-# ======================================================================================
-print_header(config_file)
-
-config_updates = [
-    # CheckLine("directory:outputs", "dir"),
-    # CheckLine("directory:logs", "dir"),
-    # CheckLine("snapshot-epochs", "epochs"),
-    CheckLine("auni-stop", "float"),
-    # change levels based on the
-    CheckLine("max-dark-matter-level", "int", answer=num_levels - 4),
-    CheckLine("sf:min-level", "int", answer=num_levels - 3),
-    CheckLine("dm_lagrangian_to_level", "int", answer=num_levels - 4),
-    CheckLine("jeans_from_level", "int", answer=num_levels - 3),
-    # timestep parameters
-    CheckLine("reduce-timestep-factor:deep-decrement", "float"),
-    CheckLine("reduce-timestep-factor:shallow-decrement", "float"),
-    CheckLine("tolerance-for-timestep-increase", "float"),
-    CheckLine("max-timestep-increment", "float"),
-    CheckLine("min-timestep-decrement", "float"),
-    CheckLine("max-dt-myr", "float"),
-    CheckLine("time-refinement-factor:max", "int"),
-]
-# We don't want to update the log directory because it should be automatically
-# generated in the submit script, as we want fresh log directories for each
-# run.
-update_file(config_file, config_updates)
+    :param machine: the Machine we're on (see machines.py)
+    :param partition: the Partition the job will run in. If given, the number of nodes
+                      and walltime are also checked against its limits.
+    """
+    dtype = parameters[name][1]
+    if dtype == "queue":
+        dtype = machine.check_partition
+    elif partition is not None and name == "#SBATCH --nodes":
 
-# ======================================================================================
-#
-# Update submit.sh
-#
-# ======================================================================================
-print_header(submit_file)
-# We need get the number of ranks per node and therefore cores per rank
-# first just go through the file and identify the current values
-with open(submit_file, "r") as in_file:
-    for line in in_file:
+        def dtype(value):
+            test_integer(value)
+            partition.check_nodes(value)
+
+    elif partition is not None and name == "#SBATCH --time":
+
+        def dtype(value):
+            test_walltime(value)
+            partition.check_walltime(value)
+
+    # The submit script sets its options with "=", while the others use spaces
+    if name.startswith("#SBATCH") or name == "work_dir":
+        separator = "="
+    else:
+        separator = " "
+    return CheckLine(
+        name, dtype, answer=answer, separator=separator, submit_line=machine.submit_line
+    )
+
+
+def level_answers(num_levels):
+    """
+    Get the values of the lines in config.cfg that depend on the number of levels.
+
+    rtype: dict of {line name: value}
+    """
+    return {
+        "max-dark-matter-level": num_levels - 4,
+        "sf:min-level": num_levels - 3,
+        "dm_lagrangian_to_level": num_levels - 4,
+        "jeans_from_level": num_levels - 3,
+    }
+
+
+def get_submit_options(submit_lines):
+    """
+    Get the current values of the #SBATCH options in a submit script.
+
+    rtype: dict of {option name, such as "partition": value}
+    """
+    options = dict()
+    for line in submit_lines:
         if line.startswith("#SBATCH --"):
             data = line.split("--")[-1]
             # all these options have an "=" in their specification
             if "=" in data:
                 key, old_value = data.split("=")
-                old_value = old_value.strip()  # get rid of newline
-                if key == "ntasks-per-node":
-                    old_ranks_per_node = int(old_value)
-                elif key == "partition":
-                    old_partition = old_value
-
-# Then get the new partition
-answer_partition = input(f"Queue = {old_partition}: ")
-if len(answer_partition) == 0:
-    answer_partition = old_partition
-# check the validity of this answer
-try:
-    if machine == "stampede2":
-        test_queue_stampede2(answer_partition)
-    else:
-        raise RuntimeError("Machine not supported")
-except ValueError:
-    raise ValueError("Partition is not valid.")
-
-# then we can ask the user whether they want to change these
-answer_ranks_per_node = input(f"MPI ranks per node = {old_ranks_per_node}: ")
-if len(answer_ranks_per_node) == 0:
-    answer_ranks_per_node = old_ranks_per_node
-# check the validity of this answer
-try:
-    test_integer(answer_ranks_per_node)
-    answer_ranks_per_node = int(answer_ranks_per_node)
-except ValueError:
-    raise ValueError("Ranks per node must be an integer.")
-
-
-# Then determine whether or not this evenly uses all cores on the node
-if machine == "stampede2":
-    if "skx" in answer_partition:
-        ncpus = 48
-    else:
-        ncpus = 68  # KNL nodes
-elif machine == "frontera":
-    ncpus = 56
-elif machine == "anvil":
-    ncpus = 128
-else:
-    raise RuntimeError("Machine not recognized")
-
-n_cpus_per_task = ncpus / answer_ranks_per_node
-if int(n_cpus_per_task) != n_cpus_per_task:
-    raise RuntimeError(
-        f"Running {answer_ranks_per_node} MPI ranks per mode results in an "
-        "uneven number of cores per rank. Choose again."
+                options[key] = old_value.strip()  # get rid of newline
+    return options
+
+
+# A rough model of how well ART runs with a given layout, used to suggest one. Each
+# thread of a rank only speeds up the part of the code that is threaded, while each
+# extra rank adds communication. Each rank also needs memory of its own, on top of
+# what it needs for its share of the grid. These numbers are guesses, not measured,
+# so tune them once real runs show which layouts work best.
+threaded_fraction = 0.95
+communication_cost = 0.05  # fraction lost per doubling of the number of ranks
+memory_per_rank_overhead = 1.0  # GB
+min_memory_per_rank = 2.0  # GB, on top of the overhead
+
+
+def get_cpus_per_task(machine, partition, ranks_per_node):
+    """
+    Get the number of cores each MPI rank gets, checking that this evenly uses all
+    cores on the node.
+
+    rtype: int
+    """
+    ncpus = machine.partition(partition).cores
+
+    n_cpus_per_task = ncpus / ranks_per_node
+    if int(n_cpus_per_task) != n_cpus_per_task:
+        raise RuntimeError(
+            f"Running {ranks_per_node} MPI ranks per mode results in an "
+            "uneven number of cores per rank. Choose again."
+        )
+    return int(n_cpus_per_task)
+
+
+class Layout(object):
+    """
+    One way to split the cores of each node into MPI ranks and threads.
+    """
+
+    def __init__(self, ranks_per_node, cpus_per_task, n_nodes, memory_per_node):
+        self.ranks_per_node = ranks_per_node
+        self.cpus_per_task = cpus_per_task
+        self.memory_per_rank = memory_per_node / ranks_per_node
+        self.enough_memory = (
+            self.memory_per_rank - memory_per_rank_overhead >= min_memory_per_rank
+        )
+
+        # Amdahl's law for the threads within a rank
+        self.thread_efficiency = 1 / (
+            (1 - threaded_fraction) * cpus_per_task + threaded_fraction
+        )
+        n_ranks = ranks_per_node * n_nodes
+        self.rank_efficiency = 1 / (1 + communication_cost * math.log2(n_ranks))
+        self.efficiency = self.thread_efficiency * self.rank_efficiency
+
+    def __str__(self):
+        return (
+            f"{self.ranks_per_node:>4} ranks x {self.cpus_per_task:>3} threads  "
+            f"{self.memory_per_rank:6.1f} GB/rank  "
+            f"efficiency {self.efficiency:.2f}"
+            + ("" if self.enough_memory else "  (too little memory per rank)")
+        )
+
+
+def get_layouts(machine, partition, n_nodes):
+    """
+    Get every layout that evenly uses all cores on the node, best first. Layouts with
+    too little memory per rank are put last.
+
+    rtype: list of Layout
+    """
+    node = machine.partition(partition)
+    layouts = [
+        Layout(ranks, node.cores // ranks, n_nodes, node.memory)
+        for ranks in range(1, node.cores + 1)
+        if node.cores % ranks == 0
+    ]
+    return sorted(
+        layouts, key=lambda layout: (not layout.enough_memory, -layout.efficiency)
+    )
+
+
+# ======================================================================================
+#
+# Asking the user what to change
+#
+# ======================================================================================
+def main():
+    user_input.parse_batch_args()
+
+    # check arguments provided
+    if len(sys.argv) != 2:
+        raise RuntimeError(
+            "Incorrect number of arguments provided to update_run_files.py"
+        )
+
+    home_dir = Path(sys.argv[1]).resolve()
+    defs_file = home_dir / "defs.h"
+    config_file = home_dir / "run" / "config.cfg"
+    submit_file = home_dir / "run" / "submit.sh"
+
+    machine = machines.get_machine()
+
+    # ----------------------------------------------------------------------------------
+    # Update defs.h
+    # ----------------------------------------------------------------------------------
+    print_header(defs_file)
+
+    defs_updates = [make_check_line("#define num_refinement_levels", machine)]
+    defs_lines = update_file(defs_file, defs_updates)
+
+    # Then grab the newly calculated level, so we can use it to calculate some other
+    # quantities of interest used later
+    if defs_updates[0].name not in defs_lines:
+        raise RuntimeError(f"{defs_updates[0].name} not found in {defs_file}")
+    num_levels = int(defs_lines[defs_updates[0].name].split()[-1])
+
+    # ----------------------------------------------------------------------------------
+    # Update config.cfg
+    # ----------------------------------------------------------------------------------
+    print_header(config_file)
+
+    config_updates = [
+        # CheckLine("directory:outputs", "dir"),
+        # CheckLine("directory:logs", "dir"),
+        # CheckLine("snapshot-epochs", "epochs"),
+        make_check_line("auni-stop", machine),
+    ]
+    # change levels based on the number of levels
+    for name, answer in level_answers(num_levels).items():
+        config_updates.append(make_check_line(name, machine, answer=answer))
+    # timestep parameters
+    for name in [
+        "reduce-timestep-factor:deep-decrement",
+        "reduce-timestep-factor:shallow-decrement",
+        "tolerance-for-timestep-increase",
+        "max-timestep-increment",
+        "min-timestep-decrement",
+        "max-dt-myr",
+        "time-refinement-factor:max",
+    ]:
+        config_updates.append(make_check_line(name, machine))
+    # We don't want to update the log directory because it should be automatically
+    # generated in the submit script, as we want fresh log directories for each
+    # run.
+    update_file(config_file, config_updates)
+
+    # ----------------------------------------------------------------------------------
+    # Update submit.sh
+    # ----------------------------------------------------------------------------------
+    print_header(submit_file)
+    # We need get the number of ranks per node and therefore cores per rank
+    # first just go through the file and identify the current values. We hold on to
+    # the lines so we don't need to read the file again when updating it.
+    submit_lines = read_lines(submit_file)
+    submit_options = get_submit_options(submit_lines)
+    old_ranks_per_node = int(submit_options["ntasks-per-node"])
+    old_partition = submit_options["partition"]
+
+    # Then get the new partition
+    answer_partition = user_input.get_input(
+        f"Queue = {old_partition}: ", key="partition"
+    )
+    if len(answer_partition) == 0:
+        answer_partition = old_partition
+    # check the validity of this answer
+    try:
+        partition = machine.partition(answer_partition)
+    except ValueError:
+        raise ValueError("Partition is not valid.")
+
+    # The layouts depend on the number of nodes, so we need that first
+    old_nodes = int(submit_options["nodes"])
+    answer_nodes = user_input.get_input(f"Nodes = {old_nodes}: ", key="#SBATCH --nodes")
+    if len(answer_nodes) == 0:
+        answer_nodes = old_nodes
+    try:
+        test_integer(answer_nodes)
+        answer_nodes = int(answer_nodes)
+    except ValueError:
+        raise ValueError("Nodes must be an integer.")
+    partition.check_nodes(answer_nodes)
+
+    # Then show the ways to use the cores on each node. The best one with enough memory
+    # is the default, unless nobody is there to answer, in which case we keep what's
+    # already there.
+    layouts = get_layouts(machine, answer_partition, answer_nodes)
+    default_ranks_per_node = old_ranks_per_node
+    if not user_input.is_batch() and layouts[0].enough_memory:
+        default_ranks_per_node = layouts[0].ranks_per_node
+    print(f"\nPossible layouts for {answer_nodes} {answer_partition} nodes.")
+    print("Ranked by a rough, uncalibrated model, best first:")
+    for layout in layouts:
+        notes = []
+        if layout.ranks_per_node == default_ranks_per_node:
+            notes.append("default")
+        if layout.ranks_per_node == old_ranks_per_node:
+            notes.append("current")
+        print(f"    {layout}" + (f"  <-- {', '.join(notes)}" if notes else ""))
+
+    # then we can ask the user whether they want to change these
+    answer_ranks_per_node = user_input.get_input(
+        f"MPI ranks per node = {default_ranks_per_node}: ", key="ranks_per_node"
     )
+    if len(answer_ranks_per_node) == 0:
+        answer_ranks_per_node = default_ranks_per_node
+    # check the validity of this answer
+    try:
+        test_integer(answer_ranks_per_node)
+        answer_ranks_per_node = int(answer_ranks_per_node)
+    except ValueError:
+        raise ValueError("Ranks per node must be an integer.")
 
+    # Then determine whether or not this evenly uses all cores on the node
+    n_cpus_per_task = get_cpus_per_task(
+        machine, answer_partition, answer_ranks_per_node
+    )
 
-# Then if everything worked, we can use these answers
-submit_updates = [
-    CheckLine(
-        "#SBATCH --partition",
-        f"queue_{machine}",
-        separator="=",
-        answer=answer_partition,
-    ),
-    CheckLine(
-        "#SBATCH --ntasks-per-node",
-        "int",
-        separator="=",
-        answer=int(answer_ranks_per_node),
-    ),
-    CheckLine(
-        "#SBATCH --cpus-per-task", "int", separator="=", answer=int(n_cpus_per_task)
-    ),
-    CheckLine("#SBATCH --time", "walltime", separator="="),
-    CheckLine("#SBATCH --nodes", "int", separator="="),
-    CheckLine("submission_stampede2", "none"),  # other parameters not used
-    # make sure the work directory in the submit script matches this directory
-    CheckLine("work_dir", "dir", separator="=", answer=str(home_dir)),
-]
-
-update_file(submit_file, submit_updates)
+    # Then if everything worked, we can use these answers
+    submit_updates = [
+        make_check_line("#SBATCH --partition", machine, answer=answer_partition),
+        make_check_line(
+            "#SBATCH --ntasks-per-node", machine, answer=answer_ranks_per_node
+        ),
+        make_check_line("#SBATCH --cpus-per-task", machine, answer=n_cpus_per_task),
+        make_check_line("#SBATCH --time", machine, partition=partition),
+        make_check_line("#SBATCH --nodes", machine, answer=answer_nodes),
+        make_check_line("submission_stampede2", machine),  # other parameters not used
+        # make sure the work directory in the submit script matches this directory
+        make_check_line("work_dir", machine, answer=str(home_dir)),
+    ]
+
+    update_file(submit_file, submit_updates, submit_lines)
+
+
+if __name__ == "__main__":
+    main()
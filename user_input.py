@@ -0,0 +1,104 @@
+"""
+user_input.py - Questions asked to the user, shared by all the scripts so that they can
+also be run without anyone there to answer them.
+
+Every script that uses this accepts the following arguments, which are removed before
+the script looks at its own arguments:
+- '--yes': answer yes to every yes/no question, and keep the current value for every
+  other question.
+- '--answers=<file>': JSON file with answers to specific questions. Its keys are listed
+  in the docstring of each script, and its values are either strings or, for yes/no
+  questions, true/false. Questions not in the file are asked as usual, unless '--yes'
+  is also passed.
+
+These are passed on to any script called by another through the NEW_RUN_YES and
+NEW_RUN_ANSWERS environment variables, which can also be set directly. The Ranch
+password can be given in the RANCH_PASSWORD environment variable.
+"""
+
+import getpass
+import json
+import os
+import sys
+
+yes_to_all = False
+answers = dict()
+
+
+def parse_batch_args():
+    """
+    Read the arguments that control the answers, and remove them from sys.argv.
+    """
+    global yes_to_all, answers
+
+    for arg in sys.argv[1:]:
+        if arg in ["--yes", "-y"]:
+            os.environ["NEW_RUN_YES"] = "1"
+            sys.argv.remove(arg)
+        elif arg.startswith("--answers="):
+            answers_file = os.path.abspath(arg.split("=", 1)[-1])
+            os.environ["NEW_RUN_ANSWERS"] = answers_file
+            sys.argv.remove(arg)
+
+    yes_to_all = os.environ.get("NEW_RUN_YES", "0") == "1"
+    if "NEW_RUN_ANSWERS" in os.environ:
+        with open(os.environ["NEW_RUN_ANSWERS"], "r") as in_file:
+            answers = json.load(in_file)
+
+
+def is_batch():
+    """
+    Whether any answers were provided ahead of time.
+    """
+    return yes_to_all or len(answers) > 0
+
+
+def lookup(key):
+    """
+    Get the answer to a question from the answers file, if it's there.
+
+    rtype: str, or None if this question has no answer in the file
+    """
+    if key is None or key not in answers:
+        return None
+    return str(answers[key])
+
+
+def get_yn_input(prompt, key=None):
+    if key in answers:
+        answer = answers[key]
+        if isinstance(answer, str):
+            answer = answer.lower() in ["y", "yes", "true"]
+        print(f"{prompt} (y/n) {'y' if answer else 'n'}")
+        return bool(answer)
+    if yes_to_all:
+        print(f"{prompt} (y/n) y")
+        return True
+
+    answer = input(prompt + " (y/n) ")
+    while answer.lower() not in ["y", "n"]:
+        answer = input("Enter y or n: ")
+
+    return answer == "y"
+
+
+def get_input(prompt, key=None):
+    """
+    Ask the user for a value. An empty answer means to keep the current value, which
+    is also what '--yes' does.
+    """
+    answer = lookup(key)
+    if answer is None and yes_to_all:
+        answer = ""
+    if answer is not None:
+        print(prompt + answer)
+        return answer
+    return input(prompt)
+
+
+def get_password(prompt):
+    if "RANCH_PASSWORD" in os.environ:
+        return os.environ["RANCH_PASSWORD"]
+    if is_batch():
+        raise RuntimeError("Set RANCH_PASSWORD to run this without a person there.")
+    return getpass.getpass(prompt=prompt)